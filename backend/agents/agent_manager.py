@@ -1,62 +1,255 @@
 # agents/agent_manager.py
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
 from sqlalchemy.orm import Session
 import json
+import logging
 
-from agents.tools.llm_client import LLMClient
+from agents.tools.llm_client import AsyncLLMClient, LLMClient
 from agents.tools.retriever_tfidf import TFIDFRetriever
+from agents.tools.retriever_bm25 import BM25Retriever
+from agents.tools.retriever_dense import DenseRetriever, check_available as check_dense
 from agents.tools.graph_sos import GraphSOS
 from agents.tools.unigraph_adapter import UniGraphAdapter
 from agents.tools.gnn_adapter import GNNAdapter
 from agents.tools.graph_translator import GraphTranslator
+from core.config import settings
+from db.database import SessionLocal
 from models.llm import PromptTemplate
 from utils.timers import timer
-from utils.tokens import estimate_tokens
+from utils.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Retriever backends selectable per request or via RETRIEVER_BACKEND;
+# "hybrid" fuses the backends listed in HYBRID_RETRIEVERS
+RETRIEVERS = {
+    "tfidf": TFIDFRetriever,
+    "bm25": BM25Retriever,
+    "dense": DenseRetriever
+}
+HYBRID = "hybrid"
+# Backends with optional dependencies: name -> check raising RuntimeError if missing
+RETRIEVER_CHECKS = {
+    "dense": check_dense
+}
+
+# Shared pool for running retrievers concurrently
+_retrieval_pool = ThreadPoolExecutor(
+    max_workers=settings.RETRIEVER_POOL_WORKERS,
+    thread_name_prefix="retrieval"
+)
+
+def reciprocal_rank_fusion(
+    rankings: List[List[str]],
+    top_k: int,
+    k: int = 60
+) -> List[str]:
+    """Fuse ranked lists: score(d) = sum over lists of 1 / (k + rank of d)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, node_id in enumerate(ranking, start=1):
+            scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (k + rank)
+    # Ties keep first-seen order, so earlier retrievers win
+    return sorted(scores, key=lambda node_id: -scores[node_id])[:top_k]
+
+def _timed_retrieve(
+    name: str,
+    graph_id: str,
+    queries: List[str],
+    top_k: int
+) -> Tuple[List[List[str]], float]:
+    """Run one retriever on its own DB session (sessions are not thread-safe)"""
+    db = SessionLocal()
+    try:
+        with timer() as t:
+            results = RETRIEVERS[name]().retrieve_many(
+                db=db,
+                graph_id=graph_id,
+                queries=queries,
+                top_k=top_k
+            )
+        return results, t["elapsed_ms"]
+    finally:
+        db.close()
 
 class AgentManager:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, retriever: Optional[str] = None):
         self.db = db
         self.llm_client = LLMClient()
-        self.retriever = TFIDFRetriever()
+        self.async_llm_client = AsyncLLMClient()
+        self.retriever_name = retriever or settings.RETRIEVER_BACKEND
+        
+        if self.retriever_name == HYBRID:
+            self.hybrid_components = [
+                name.strip() for name in settings.HYBRID_RETRIEVERS.split(",") if name.strip()
+            ]
+        else:
+            self.hybrid_components = []
+        
+        for name in self.hybrid_components or [self.retriever_name]:
+            if name not in RETRIEVERS:
+                raise ValueError(
+                    f"Unknown retriever '{name}', expected one of {sorted(RETRIEVERS) + [HYBRID]}"
+                )
+        
+        # Hybrid fuses whichever components can load; a single backend must load
+        self.skipped_components: Dict[str, str] = {}
+        if self.hybrid_components:
+            for name in self.hybrid_components:
+                try:
+                    if name in RETRIEVER_CHECKS:
+                        RETRIEVER_CHECKS[name]()
+                except RuntimeError as e:
+                    self.skipped_components[name] = str(e)
+            self.hybrid_components = [
+                name for name in self.hybrid_components if name not in self.skipped_components
+            ]
+            if not self.hybrid_components:
+                raise RuntimeError(
+                    "No hybrid retriever can load: " + "; ".join(self.skipped_components.values())
+                )
+        elif self.retriever_name in RETRIEVER_CHECKS:
+            RETRIEVER_CHECKS[self.retriever_name]()
+        
+        self.retriever = None if self.hybrid_components else RETRIEVERS[self.retriever_name]()
         self.graph_sos = GraphSOS()
         self.unigraph = UniGraphAdapter()
         self.gnn_adapter = GNNAdapter()
         self.translator = GraphTranslator()
     
+    def retrieve_many(
+        self,
+        graph_id: str,
+        query_texts: List[str],
+        top_k: int = 5
+    ) -> Tuple[List[List[str]], Dict[str, Optional[float]]]:
+        """Retrieve seed nodes for each query; also returns per-retriever timings in ms.
+        
+        Hybrid components that are unavailable or fail are left out of the
+        fusion and reported with a None timing.
+        """
+        if not self.hybrid_components:
+            with timer() as t:
+                results = self.retriever.retrieve_many(
+                    db=self.db,
+                    graph_id=graph_id,
+                    queries=query_texts,
+                    top_k=top_k
+                )
+            return results, {self.retriever_name: t["elapsed_ms"]}
+        
+        # Run every component concurrently; wall time is that of the slowest one.
+        # Each list is deeper than top_k so fusion has candidates to re-rank.
+        futures = {
+            name: _retrieval_pool.submit(
+                _timed_retrieve, name, graph_id, query_texts, top_k * 2
+            )
+            for name in self.hybrid_components
+        }
+        component_results = {}
+        timings: Dict[str, Optional[float]] = {}
+        error = None
+        for name, future in futures.items():
+            try:
+                component_results[name], timings[name] = future.result()
+            except Exception as e:
+                logger.warning(f"Hybrid retriever '{name}' failed, fusing the others: {e}")
+                timings[name] = None
+                error = e
+        if not component_results:
+            raise error
+        timings.update((name, None) for name in self.skipped_components)
+        
+        fused = [
+            reciprocal_rank_fusion(
+                [results[i] for results in component_results.values()],
+                top_k,
+                k=settings.RRF_K
+            )
+            for i in range(len(query_texts))
+        ]
+        return fused, timings
+    
     def prepare_rag_context(
         self,
         graph_id: str,
         query_text: str,
         top_k: int = 5,
-        hops: int = 2
+        hops: int = 2,
+        max_context_tokens: Optional[int] = None
     ) -> Dict[str, Any]:
         """Prepare RAG context from graph"""
         with timer() as t:
             # Get retrieval results
-            retrieved_nodes = self.retriever.retrieve(
-                db=self.db,
+            retrieved, timings = self.retrieve_many(
                 graph_id=graph_id,
-                query=query_text,
+                query_texts=[query_text],
                 top_k=top_k
             )
+            retrieved_nodes = retrieved[0]
             
             # Expand with GraphSOS
             context = self.graph_sos.serialize(
                 db=self.db,
                 graph_id=graph_id,
                 seed_nodes=retrieved_nodes,
-                hops=hops
+                hops=hops,
+                max_context_tokens=max_context_tokens
             )
             
-            tokens = estimate_tokens(context)
+            tokens = count_tokens(context)
         
         return {
             "context": context,
             "retrieved_nodes": retrieved_nodes,
             "tokens_in_context": tokens,
-            "retrieval_ms": t["elapsed_ms"]
+            "retrieval_ms": t["elapsed_ms"],
+            "retriever_timings": timings
         }
     
+    def prepare_rag_contexts(
+        self,
+        graph_id: str,
+        query_texts: List[str],
+        top_k: int = 5,
+        hops: int = 2,
+        max_context_tokens: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Prepare RAG contexts for many queries with a single batched retrieval"""
+        with timer() as t:
+            retrieved, timings = self.retrieve_many(
+                graph_id=graph_id,
+                query_texts=query_texts,
+                top_k=top_k
+            )
+        # Batched retrieval cost is shared evenly across the queries
+        n = max(len(query_texts), 1)
+        shared_ms = t["elapsed_ms"] / n
+        shared_timings = {name: ms / n if ms is not None else None for name, ms in timings.items()}
+        
+        results = []
+        for retrieved_nodes in retrieved:
+            with timer() as t:
+                context = self.graph_sos.serialize(
+                    db=self.db,
+                    graph_id=graph_id,
+                    seed_nodes=retrieved_nodes,
+                    hops=hops,
+                    max_context_tokens=max_context_tokens
+                )
+                tokens = count_tokens(context)
+            
+            results.append({
+                "context": context,
+                "retrieved_nodes": retrieved_nodes,
+                "tokens_in_context": tokens,
+                "retrieval_ms": shared_ms + t["elapsed_ms"],
+                "retriever_timings": shared_timings
+            })
+        
+        return results
+    
     def generate_response(
         self,
         query_text: str,
@@ -65,21 +258,7 @@ class AgentManager:
         llm_config: Optional[Dict] = None
     ) -> Dict[str, Any]:
         """Generate LLM response"""
-        # Get prompt template
-        template = self.db.query(PromptTemplate).filter(
-            PromptTemplate.template_id == prompt_template_id
-        ).first()
-        
-        if not template:
-            template_text = "{context}\n\nQuestion: {question}"
-        else:
-            template_text = template.text
-        
-        # Format prompt
-        prompt = template_text.format(
-            context=context,
-            question=query_text
-        )
+        prompt = self.build_prompt(query_text, context, prompt_template_id)
         
         # Generate with LLM
         with timer() as t:
@@ -89,4 +268,63 @@ class AgentManager:
             **result,
             "generation_ms": t["elapsed_ms"],
             "prompt": prompt
-        }# Agent manager for orchestrating agent lifecycles
+        }
+    
+    async def agenerate_response(
+        self,
+        prompt: str,
+        llm_config: Optional[Dict] = None
+    ) -> Dict[str, Any]:
+        """Generate LLM response without blocking the event loop.
+        
+        Takes a prompt from build_prompt(s), which reads the template from
+        the DB and so belongs in a worker thread, not on the event loop.
+        """
+        with timer() as t:
+            result = await self.async_llm_client.send(prompt, llm_config or {})
+        
+        return {
+            **result,
+            "generation_ms": t["elapsed_ms"],
+            "prompt": prompt
+        }
+    
+    async def astream_response(
+        self,
+        prompt: str,
+        llm_config: Optional[Dict] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream LLM response for a built prompt: {"token": text} events,
+        then {"result": ...} with timings"""
+        async for event in self.async_llm_client.stream(prompt, llm_config or {}):
+            if "result" in event:
+                event = {"result": {**event["result"], "prompt": prompt}}
+            yield event
+    
+    def build_prompt(self, query_text: str, context: str, prompt_template_id: str = "default_rag") -> str:
+        """Fill the prompt template for one query (queries the DB)"""
+        return self.build_prompts([query_text], [context], prompt_template_id)[0]
+    
+    def build_prompts(
+        self,
+        query_texts: List[str],
+        contexts: List[str],
+        prompt_template_id: str = "default_rag"
+    ) -> List[str]:
+        """Fill the prompt template for many queries with a single template lookup"""
+        template_text = self._template_text(prompt_template_id)
+        return [
+            template_text.format(context=context, question=query_text)
+            for query_text, context in zip(query_texts, contexts)
+        ]
+    
+    def _template_text(self, prompt_template_id: str) -> str:
+        # Get prompt template
+        template = self.db.query(PromptTemplate).filter(
+            PromptTemplate.template_id == prompt_template_id
+        ).first()
+        
+        if not template:
+            return "{context}\n\nQuestion: {question}"
+        return template.text
+# Agent manager for orchestrating agent lifecycles
@@ -0,0 +1,90 @@
+# agents/tools/fragment_store.py
+from sqlalchemy.orm import Session
+from typing import Dict, List, Optional, Tuple
+from agents.tools.graph_features import get_features
+from core.config import settings
+from models.graph import NodeText
+from utils.cache import (
+    FEATURE_SCOPE, LRUCache, TEXT_SCOPE, graph_version, register_invalidation_hook
+)
+from utils.tokens import count_node_tokens, truncate_tokens
+
+# (rendered line, token count); line is None for nodes without text
+Fragment = Tuple[Optional[str], int]
+
+# Rendered node lines, keyed by (graph_id, node_id)
+_fragment_cache = LRUCache(
+    max_entries=settings.FRAGMENT_CACHE_ENTRIES,
+    max_bytes=settings.FRAGMENT_CACHE_MB * 1024 * 1024,
+    sizeof=lambda fragment: len(fragment[0] or "") + 100
+)
+
+
+def _invalidate(graph_id: str, node_ids):
+    if node_ids is None:
+        _fragment_cache.discard_where(lambda key: key[0] == graph_id)
+    else:
+        _fragment_cache.discard_where(lambda key: key[0] == graph_id and key[1] in node_ids)
+
+
+register_invalidation_hook(TEXT_SCOPE, _invalidate)
+register_invalidation_hook(FEATURE_SCOPE, _invalidate)
+
+
+def render_fragment(node_id: str, text: Optional[str], tags: Optional[str] = None) -> Fragment:
+    """Context line for one node, with its text capped at GRAPHSOS_NODE_MAX_TOKENS.
+
+    Structural feature tags, when the feature stage has run, follow the text.
+    """
+    if text is None:
+        return None, 0
+    line = f"Node {node_id}: {truncate_tokens(text, settings.GRAPHSOS_NODE_MAX_TOKENS)}"
+    if tags:
+        line = f"{line} [STRUCT: {tags}]"
+    return line, count_node_tokens(line)
+
+
+def get_fragments(db: Session, graph_id: str, node_ids: List[str]) -> Dict[str, Fragment]:
+    """Rendered fragments for the given nodes.
+
+    Cached fragments are returned without touching the database; the rest are
+    fetched in one query, rendered and cached (including nodes with no text,
+    so they are not looked up again).
+    """
+    fragments = {}
+    missing = []
+    for node_id in node_ids:
+        fragment = _fragment_cache.get((graph_id, node_id))
+        if fragment is None:
+            missing.append(node_id)
+        else:
+            fragments[node_id] = fragment
+
+    if not missing:
+        return fragments
+
+    version = (graph_version(graph_id, TEXT_SCOPE), graph_version(graph_id, FEATURE_SCOPE))
+    texts = dict(db.query(NodeText.node_id, NodeText.text).filter(
+        NodeText.graph_id == graph_id,
+        NodeText.node_id.in_(missing)
+    ).all())
+    features = get_features(db, graph_id)
+    positions = features.lookup(missing).tolist() if features else [-1] * len(missing)
+
+    # Don't cache data read while an update was being applied
+    cacheable = version == (
+        graph_version(graph_id, TEXT_SCOPE), graph_version(graph_id, FEATURE_SCOPE)
+    )
+    for node_id, i in zip(missing, positions):
+        tags = features.tags(i) if i >= 0 else None
+        fragment = render_fragment(node_id, texts.get(node_id), tags)
+        fragments[node_id] = fragment
+        if cacheable:
+            _fragment_cache.put((graph_id, node_id), fragment)
+    return fragments
+
+
+def fragment_cache_stats():
+    """Hit/miss/eviction counters of the fragment cache"""
+    return _fragment_cache.stats()
+# Per-node rendered context fragments
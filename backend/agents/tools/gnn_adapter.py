@@ -1,10 +1,32 @@
 # agents/tools/gnn_adapter.py
-import networkx as nx
+import re
+import numpy as np
+from sqlalchemy import tuple_, update
 from sqlalchemy.orm import Session
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Set, Tuple
 import json
-from models.graph import Node, Edge, NodeText
-from models.run import Artifact
+from agents.tools.graph_features import (
+    FEATURE_NAMES, cache_features, compute_all, degree, eigenvector_centrality, get_features,
+    local_clustering, pagerank, save_features, update_core_numbers, update_features
+)
+from agents.tools.graph_store import GraphAdjacency, get_adjacency
+from core.config import settings
+from models.graph import Edge, NodeText
+from models.run import Artifact, Run
+from utils.cache import FEATURE_SCOPE, TEXT_SCOPE, LRUCache, invalidate_graph
+from utils.jobs import ProgressCallback
+
+LEGACY_TAG = re.compile(r"\s*\[STRUCT: [^\]]*\]")
+
+# Incremental runs rewrite a stored PageRank/eigenvector value only if it moved more than this
+FEATURE_WRITE_RTOL = 1e-4
+
+# Adjacency each graph's latest feature run used; its max_edge_id is that run's watermark
+_run_adjacency = LRUCache(
+    max_entries=settings.GRAPH_CACHE_ENTRIES,
+    max_bytes=settings.GRAPH_CACHE_MB * 1024 * 1024,
+    sizeof=lambda adjacency: adjacency.nbytes
+)
 
 class GNNAdapter:
     """Add structural bias via graph features"""
@@ -13,46 +35,58 @@ class GNNAdapter:
         self,
         db: Session,
         graph_id: str,
-        run_id: str
+        run_id: str,
+        incremental: bool = False,
+        progress: Optional[ProgressCallback] = None
     ) -> Dict[str, Any]:
-        """Compute structural features for nodes"""
-        
-        # Build NetworkX graph
-        G = nx.Graph()
-        
-        nodes = db.query(Node).filter(Node.graph_id == graph_id).all()
-        for node in nodes:
-            G.add_node(node.node_id)
-        
-        edges = db.query(Edge).filter(Edge.graph_id == graph_id).all()
-        for edge in edges:
-            G.add_edge(edge.src, edge.dst)
-        
-        # Compute features
-        degrees = dict(G.degree())
-        pagerank = nx.pagerank(G, max_iter=100) if len(G) > 0 else {}
-        clustering = nx.clustering(G) if len(G) > 0 else {}
-        
-        # Add as text tags to nodes
-        for node_id in G.nodes():
-            features = []
-            if node_id in degrees:
-                features.append(f"degree:{degrees[node_id]}")
-            if node_id in pagerank:
-                features.append(f"pagerank:{pagerank[node_id]:.4f}")
-            if node_id in clustering:
-                features.append(f"clustering:{clustering[node_id]:.4f}")
-            
-            # Update NodeText with structural tags
-            node_text = db.query(NodeText).filter(
-                NodeText.graph_id == graph_id,
-                NodeText.node_id == node_id
-            ).first()
-            
-            if node_text:
-                node_text.text = f"{node_text.text} [STRUCT: {' '.join(features)}]"
+        """Compute structural features for nodes.
+        
+        With incremental=True, only edges added since the last feature run are
+        applied to the stored features. Falls back to a full recomputation if
+        there is nothing stored yet or more than GNN_INCREMENTAL_MAX_EDGES
+        edges were added.
         
+        progress(fraction, message) is called between steps; its last call
+        comes before anything is written.
+        """
+        report = progress or (lambda fraction, message: None)
+        
+        # The adjacency knows the last edge it includes; edges above it are
+        # picked up by the next incremental run
+        report(0.0, "loading graph")
+        adjacency = get_adjacency(db, graph_id)
+        max_edge_id = adjacency.max_edge_id
+        watermark = self._last_watermark(db, graph_id)
+        
+        report(0.1, "applying new edges" if incremental else "computing features")
+        delta = self._incremental_update(db, graph_id, adjacency, watermark) if incremental else None
+        if delta is None:
+            mode = "full"
+            features = compute_all(
+                adjacency,
+                progress=lambda fraction, name: report(0.1 + 0.8 * fraction, f"computing {name}")
+            )
+            report(0.9, "saving features")
+            save_features(db, graph_id, adjacency.node_ids, features)
+            nodes_updated = adjacency.num_nodes
+        else:
+            mode = "incremental"
+            features, rows, new_rows = delta
+            report(0.9, "saving features")
+            update_features(db, graph_id, adjacency.node_ids, features, rows, new_rows)
+            nodes_updated = len(rows)
+        degrees = features["degree"]
+        
+        # Node text stays untouched. Tags were only written by feature runs that
+        # predate watermarks, so once a run has recorded one the scan is skipped.
+        stripped = self._strip_legacy_tags(db, graph_id) if watermark is None else []
         db.commit()
+        invalidate_graph(graph_id, scopes=(FEATURE_SCOPE,))
+        # Serve the features just written without reading them back next run
+        cache_features(graph_id, adjacency.node_ids, features)
+        _run_adjacency.put(graph_id, adjacency)
+        if stripped:
+            invalidate_graph(graph_id, scopes=(TEXT_SCOPE,), node_ids=stripped)
         
         # Save features as artifact
         artifact = Artifact(
@@ -60,15 +94,162 @@ class GNNAdapter:
             kind="gnn_features",
             path=f"data/outputs/{run_id}_gnn_features.json",
             meta_json=json.dumps({
-                "num_nodes": len(G.nodes()),
-                "num_edges": len(G.edges()),
-                "avg_degree": sum(degrees.values()) / len(degrees) if degrees else 0
+                "num_nodes": adjacency.num_nodes,
+                "num_edges": adjacency.num_edges,
+                "avg_degree": float(degrees.mean()) if len(degrees) else 0,
+                "max_edge_id": max_edge_id,
+                "mode": mode
             })
         )
         db.add(artifact)
         db.commit()
         
         return {
-            "nodes_processed": len(G.nodes()),
-            "features_added": ["degree", "pagerank", "clustering"]
-        }# Structural bias adapter (stub APIs)
+            "nodes_processed": adjacency.num_nodes,
+            "nodes_updated": nodes_updated,
+            "mode": mode,
+            "features_added": list(features)
+        }
+    
+    def _incremental_update(
+        self,
+        db: Session,
+        graph_id: str,
+        adjacency: GraphAdjacency,
+        watermark: Optional[int]
+    ) -> Optional[Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray]]:
+        """Stored features patched for edges added since the last run (watermark).
+        
+        Returns (features aligned with adjacency.node_ids, rows to write, rows
+        to insert), or None if a full recomputation is needed.
+        """
+        previous = get_features(db, graph_id)
+        if previous is None or watermark is None:
+            return None
+        
+        positions = previous.lookup(adjacency.node_ids.tolist())
+        known = positions >= 0
+        if int(known.sum()) != len(previous.node_ids):
+            return None
+        
+        new_edges = db.query(Edge.src, Edge.dst).filter(
+            Edge.graph_id == graph_id,
+            Edge.id > watermark
+        ).all()
+        if len(new_edges) > settings.GNN_INCREMENTAL_MAX_EDGES:
+            return None
+        
+        # Only node pairs that were not connected before change the structure
+        existing = self._existing_pairs(db, graph_id, watermark, new_edges)
+        pairs = list(dict.fromkeys(
+            (min(src, dst), max(src, dst)) for src, dst in new_edges
+            if (min(src, dst), max(src, dst)) not in existing
+        ))
+        pair_idx = adjacency.lookup([node_id for pair in pairs for node_id in pair])
+        new_pairs = [tuple(p) for p in pair_idx.reshape(-1, 2).tolist()]
+        
+        # Start from the stored values; new nodes start isolated
+        n = adjacency.num_nodes
+        features = {}
+        for name in FEATURE_NAMES:
+            column = np.zeros(n, dtype=previous.columns[name].dtype)
+            column[known] = previous.columns[name][positions[known]]
+            features[name] = column
+        new_rows = np.flatnonzero(~known)
+        
+        # Degree and clustering change only at the endpoints and their common neighbours
+        endpoints = np.unique(pair_idx).astype(np.int64)
+        closing = [
+            np.intersect1d(adjacency.neighbors(u), adjacency.neighbors(v))
+            for u, v in new_pairs if u != v
+        ]
+        touched = np.unique(np.concatenate([endpoints, *closing])).astype(np.int64)
+        features["degree"][endpoints] = degree(adjacency, endpoints)
+        features["clustering"][touched] = local_clustering(adjacency, touched)
+        old_core = features["core"]
+        features["core"] = update_core_numbers(adjacency, old_core, new_pairs)
+        
+        # Global features: warm-start power iteration from the stored vectors
+        old_pagerank = features["pagerank"].copy()
+        old_eigenvector = features["eigenvector"].copy()
+        start = old_pagerank.copy()
+        start[new_rows] = 1.0 / n
+        features["pagerank"] = pagerank(adjacency, start=start)
+        start = old_eigenvector.copy()
+        start[new_rows] = old_eigenvector[known].mean() if known.any() else 1.0
+        features["eigenvector"] = eigenvector_centrality(adjacency, start=start)
+        
+        moved = ~np.isclose(features["pagerank"], old_pagerank, rtol=FEATURE_WRITE_RTOL, atol=0)
+        moved |= ~np.isclose(features["eigenvector"], old_eigenvector, rtol=FEATURE_WRITE_RTOL, atol=0)
+        moved |= features["core"] != old_core
+        moved[touched] = True
+        moved[new_rows] = True
+        
+        return features, np.flatnonzero(moved), new_rows
+    
+    def _last_watermark(self, db: Session, graph_id: str) -> Optional[int]:
+        """max_edge_id recorded by the latest feature run of this graph"""
+        row = db.query(Artifact.meta_json).join(
+            Run, Run.run_id == Artifact.run_id
+        ).filter(
+            Run.graph_id == graph_id,
+            Artifact.kind == "gnn_features"
+        ).order_by(Artifact.id.desc()).first()
+        if row is None:
+            return None
+        return json.loads(row[0] or "{}").get("max_edge_id")
+    
+    def _existing_pairs(
+        self,
+        db: Session,
+        graph_id: str,
+        watermark: int,
+        edges: List[Tuple[str, str]]
+    ) -> Set[Tuple[str, str]]:
+        """Unordered pairs among edges already connected at or below the watermark"""
+        # The adjacency of the run that set the watermark answers this in memory
+        snapshot = _run_adjacency.get(graph_id)
+        if snapshot is not None and snapshot.max_edge_id == watermark:
+            return self._connected_pairs(snapshot, edges)
+        
+        wanted = list({(src, dst) for src, dst in edges} | {(dst, src) for src, dst in edges})
+        existing = set()
+        for start in range(0, len(wanted), 400):
+            rows = db.query(Edge.src, Edge.dst).filter(
+                Edge.graph_id == graph_id,
+                Edge.id <= watermark,
+                tuple_(Edge.src, Edge.dst).in_(wanted[start:start + 400])
+            ).all()
+            existing.update((min(src, dst), max(src, dst)) for src, dst in rows)
+        return existing
+    
+    def _connected_pairs(
+        self,
+        adjacency: GraphAdjacency,
+        edges: List[Tuple[str, str]]
+    ) -> Set[Tuple[str, str]]:
+        """Unordered pairs among edges that are connected in adjacency"""
+        src_idx = adjacency.lookup([src for src, _ in edges]).tolist()
+        dst_idx = adjacency.lookup([dst for _, dst in edges]).tolist()
+        existing = set()
+        for (src, dst), u, v in zip(edges, src_idx, dst_idx):
+            if u < 0 or v < 0:
+                continue
+            neighbors = adjacency.neighbors(u)
+            i = int(np.searchsorted(neighbors, v))
+            if i < len(neighbors) and neighbors[i] == v:
+                existing.add((min(src, dst), max(src, dst)))
+        return existing
+    
+    def _strip_legacy_tags(self, db: Session, graph_id: str) -> List[str]:
+        """Remove [STRUCT: ...] tags that older versions appended to node text"""
+        rows = db.query(NodeText.id, NodeText.node_id, NodeText.text).filter(
+            NodeText.graph_id == graph_id,
+            NodeText.text.like("%[STRUCT: %")
+        ).all()
+        if rows:
+            db.execute(update(NodeText), [
+                {"id": pk, "text": LEGACY_TAG.sub("", text)} for pk, _, text in rows
+            ])
+        return [node_id for _, node_id, _ in rows]
+# Structural bias adapter (stub APIs)
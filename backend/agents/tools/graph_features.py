@@ -0,0 +1,429 @@
+# agents/tools/graph_features.py
+import numpy as np
+from scipy import sparse
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, List, Optional, Tuple
+from agents.tools.graph_store import GraphAdjacency, lookup_sorted
+from core.config import settings
+from models.graph import NodeFeature
+from utils.cache import FEATURE_SCOPE, LRUCache, graph_version, register_invalidation_hook
+
+# Rows of the wedge product materialised at a time when counting triangles
+TRIANGLE_CHUNK_ROWS = 4096
+
+# Column order of node_features, also the order of the [STRUCT: ...] tag
+FEATURE_NAMES = ("degree", "pagerank", "clustering", "core", "eigenvector")
+INSERT_CHUNK_ROWS = 10000
+
+
+def _without_self_loops(adjacency: GraphAdjacency) -> sparse.csr_matrix:
+    matrix = adjacency.to_scipy().tocsr(copy=True)
+    matrix.setdiag(0)
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def degree(adjacency: GraphAdjacency, nodes: Optional[np.ndarray] = None) -> np.ndarray:
+    """Node degree (of all nodes, or just the given ones); a self-loop counts twice, as in NetworkX"""
+    if nodes is not None:
+        self_loops = [int(np.any(adjacency.neighbors(i) == i)) for i in nodes.tolist()]
+        return (adjacency.degrees[nodes] + np.array(self_loops, dtype=np.int64)).astype(np.int64)
+    rows = np.repeat(np.arange(adjacency.num_nodes), adjacency.degrees)
+    self_loops = np.bincount(rows[rows == adjacency.indices], minlength=adjacency.num_nodes)
+    return (adjacency.degrees + self_loops).astype(np.int64)
+
+
+def pagerank(
+    adjacency: GraphAdjacency,
+    alpha: float = 0.85,
+    max_iter: int = 100,
+    tol: float = 1e-6,
+    start: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """PageRank by power iteration; dangling nodes spread their mass uniformly.
+
+    A previous PageRank vector can be passed as start (warm start): after a
+    few edge inserts it is already within a handful of iterations of tol.
+    """
+    n = adjacency.num_nodes
+    if n == 0:
+        return np.zeros(0)
+
+    matrix = adjacency.to_scipy()
+    out_degree = np.asarray(matrix.sum(axis=1)).ravel()
+    dangling = out_degree == 0
+    inv_degree = np.divide(1.0, out_degree, out=np.zeros(n), where=~dangling)
+    transition = matrix.T.tocsr()
+
+    x = np.full(n, 1.0 / n) if start is None else start / start.sum()
+    for _ in range(max_iter):
+        last = x
+        x = alpha * (transition @ (last * inv_degree))
+        x += (alpha * last[dangling].sum() + (1 - alpha)) / n
+        if np.abs(x - last).sum() < n * tol:
+            break
+    return x
+
+
+def _oriented(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    """Keep each edge once, pointing from the lower- to the higher-degree endpoint.
+
+    Out-degrees are then at most sqrt(2m), so wedge counts stay bounded even
+    around hubs.
+    """
+    coo = matrix.tocoo()
+    d = np.diff(matrix.indptr)
+    forward = (d[coo.row] < d[coo.col]) | ((d[coo.row] == d[coo.col]) & (coo.row < coo.col))
+    return sparse.csr_matrix(
+        (np.ones(int(forward.sum())), (coo.row[forward], coo.col[forward])),
+        shape=matrix.shape
+    )
+
+
+def _closed_wedges(left: sparse.csr_matrix, right: sparse.csr_matrix, mask: sparse.csr_matrix):
+    """Row and column sums of (left @ right) restricted to mask's edges, in row chunks"""
+    n = mask.shape[0]
+    row_sums = np.zeros(n)
+    col_sums = np.zeros(n)
+    for start in range(0, n, TRIANGLE_CHUNK_ROWS):
+        stop = min(start + TRIANGLE_CHUNK_ROWS, n)
+        closed = (left[start:stop] @ right).multiply(mask[start:stop]).tocsr()
+        row_sums[start:stop] = np.asarray(closed.sum(axis=1)).ravel()
+        col_sums += np.bincount(closed.indices, weights=closed.data, minlength=n)
+    return row_sums, col_sums
+
+
+def triangles(adjacency: GraphAdjacency) -> np.ndarray:
+    """Triangles through each node (self-loops ignored)"""
+    oriented = _oriented(_without_self_loops(adjacency))
+    # Triangle a < b < c (degree order) is the oriented path a->b->c closed by a->c:
+    # (L @ L) credits a (row) and c (column); (L.T @ L) on edge b->c credits b
+    low, high = _closed_wedges(oriented, oriented, oriented)
+    middle, _ = _closed_wedges(oriented.T.tocsr(), oriented, oriented)
+    return low + high + middle
+
+
+def clustering(adjacency: GraphAdjacency) -> np.ndarray:
+    """Local clustering coefficient from triangle counts (self-loops ignored)"""
+    d = np.diff(_without_self_loops(adjacency).indptr).astype(np.float64)
+    pairs = d * (d - 1) / 2
+    return np.divide(triangles(adjacency), pairs, out=np.zeros(len(d)), where=pairs > 0)
+
+
+def core_number(adjacency: GraphAdjacency) -> np.ndarray:
+    """k-core number by Batagelj-Zaversnik bucket peeling, O(n + m).
+
+    Nodes sit in an array sorted by current degree, with bin_start marking
+    where each degree begins; taking the lowest node and moving each
+    higher-degree neighbour down one bin is a constant-time swap.
+    """
+    matrix = _without_self_loops(adjacency)
+    n = matrix.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    degrees = np.diff(matrix.indptr).astype(np.int64)
+    order = np.argsort(degrees, kind="stable")
+    position = np.empty(n, dtype=np.int64)
+    position[order] = np.arange(n)
+    counts = np.bincount(degrees)
+    bin_start = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    # Plain lists: the loop touches single elements, where numpy scalars are slow
+    deg = degrees.tolist()
+    vert = order.tolist()
+    pos = position.tolist()
+    bins = bin_start.tolist()
+    indptr = matrix.indptr.tolist()
+    indices = matrix.indices.tolist()
+
+    for i in range(n):
+        v = vert[i]
+        dv = deg[v]
+        for u in indices[indptr[v]:indptr[v + 1]]:
+            du = deg[u]
+            if du > dv:
+                # Swap u with the first node of its bin, then shrink the bin
+                pu = pos[u]
+                pw = bins[du]
+                w = vert[pw]
+                if u != w:
+                    vert[pu], vert[pw] = w, u
+                    pos[u], pos[w] = pw, pu
+                bins[du] += 1
+                deg[u] = du - 1
+    return np.array(deg, dtype=np.int64)
+
+
+def eigenvector_centrality(
+    adjacency: GraphAdjacency,
+    max_iter: int = 100,
+    tol: float = 1e-6,
+    start: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Eigenvector centrality by power iteration on (A + I), L2-normalised like NetworkX"""
+    n = adjacency.num_nodes
+    if n == 0:
+        return np.zeros(0)
+
+    matrix = adjacency.to_scipy()
+    x = np.full(n, 1.0 / n) if start is None else start / np.linalg.norm(start)
+    for _ in range(max_iter):
+        last = x
+        x = last + matrix @ last
+        norm = np.linalg.norm(x)
+        x = x / norm if norm > 0 else x
+        if np.abs(x - last).sum() < n * tol:
+            break
+    return x
+
+
+def local_clustering(adjacency: GraphAdjacency, nodes: np.ndarray) -> np.ndarray:
+    """Clustering coefficient of just the given nodes (for incremental updates)"""
+    matrix = adjacency.to_scipy()
+    result = np.zeros(len(nodes))
+    for k, node in enumerate(nodes.tolist()):
+        neighbors = adjacency.neighbors(node)
+        neighbors = neighbors[neighbors != node]
+        d = len(neighbors)
+        if d < 2:
+            continue
+        # Edges among the neighbours, minus any self-loops on the diagonal
+        among = matrix[neighbors][:, neighbors]
+        links = (among.nnz - int(np.count_nonzero(among.diagonal()))) / 2
+        result[k] = links / (d * (d - 1) / 2)
+    return result
+
+
+def update_core_numbers(
+    adjacency: GraphAdjacency,
+    core: np.ndarray,
+    new_edges: List[Tuple[int, int]]
+) -> np.ndarray:
+    """Core numbers after inserting new_edges, given the core numbers before.
+
+    Edges are applied one at a time with the traversal algorithm of Sariyuce
+    et al. (VLDB 2013). Inserting (u, v) can only raise cores by one, and only
+    for nodes with the lower endpoint's core number r. The search from that
+    endpoint only crosses nodes with more than r neighbours of core >= r
+    (MCD), which keeps it local even when most of the graph shares core r.
+    Each visited node keeps a count of the neighbours that could still
+    support it (PCD, decremented on evictions). Nodes whose count drops to r
+    are evicted, and the rest move to r + 1.
+
+    Once the traversals have scanned as many adjacency entries as the whole
+    graph holds, recomputing with core_number is cheaper and is used instead.
+    adjacency already contains all new edges; edges not yet applied are skipped.
+    """
+    core_list = core.tolist()
+    budget = len(adjacency.indices)
+    scanned = 0
+    # Pending edges are hidden until applied
+    hidden: Dict[int, set] = {}
+    for u, v in new_edges:
+        hidden.setdefault(u, set()).add(v)
+        hidden.setdefault(v, set()).add(u)
+    neighbor_lists: Dict[int, List[int]] = {}
+
+    def neighbors(node: int) -> List[int]:
+        nonlocal scanned
+        if node not in neighbor_lists:
+            skip = hidden.get(node, ())
+            neighbor_lists[node] = [
+                x for x in adjacency.neighbors(node).tolist() if x != node and x not in skip
+            ]
+        result = neighbor_lists[node]
+        scanned += len(result)
+        return result
+
+    for u, v in new_edges:
+        hidden[u].discard(v)
+        hidden[v].discard(u)
+        neighbor_lists.pop(u, None)
+        neighbor_lists.pop(v, None)
+        if u == v:
+            continue
+        root = u if core_list[u] <= core_list[v] else v
+        r = core_list[root]
+        mcd_cache: Dict[int, int] = {}
+
+        def mcd(node: int) -> int:
+            if node not in mcd_cache:
+                k = core_list[node]
+                mcd_cache[node] = sum(1 for x in neighbors(node) if core_list[x] >= k)
+            return mcd_cache[node]
+
+        def pcd(node: int) -> int:
+            k = core_list[node]
+            return sum(
+                1 for x in neighbors(node)
+                if core_list[x] > k or (core_list[x] == k and mcd(x) > k)
+            )
+
+        count = {root: pcd(root)}
+        visited = {root}
+        evicted = set()
+        stack = [root]
+        while stack:
+            if scanned > budget:
+                return core_number(adjacency)
+            node = stack.pop()
+            if count[node] > r:
+                for x in neighbors(node):
+                    if core_list[x] == r and x not in visited and mcd(x) > r:
+                        visited.add(x)
+                        count[x] = count.get(x, 0) + pcd(x)
+                        stack.append(x)
+            elif node not in evicted:
+                # Evict, and withdraw its support from core-r neighbours
+                evict = [node]
+                evicted.add(node)
+                while evict:
+                    gone = evict.pop()
+                    for x in neighbors(gone):
+                        if core_list[x] != r:
+                            continue
+                        count[x] = count.get(x, 0) - 1
+                        if count[x] == r and x in visited and x not in evicted:
+                            evicted.add(x)
+                            evict.append(x)
+
+        for node in visited - evicted:
+            core_list[node] = r + 1
+    return np.array(core_list, dtype=core.dtype)
+
+
+def compute_all(
+    adjacency: GraphAdjacency,
+    progress: Optional[Callable[[float, str], None]] = None
+) -> Dict[str, np.ndarray]:
+    """All structural features, each aligned with adjacency.node_ids.
+
+    progress(fraction done, feature name) is called before each feature.
+    """
+    compute = {
+        "degree": degree,
+        "pagerank": pagerank,
+        "clustering": clustering,
+        "core": core_number,
+        "eigenvector": eigenvector_centrality
+    }
+    features = {}
+    for i, name in enumerate(FEATURE_NAMES):
+        if progress:
+            progress(i / len(FEATURE_NAMES), name)
+        features[name] = compute[name](adjacency)
+    return features
+
+
+class NodeFeatures:
+    """Stored features of one graph: columns aligned with a sorted node id table"""
+
+    def __init__(self, node_ids: np.ndarray, columns: Dict[str, np.ndarray]):
+        self.node_ids = node_ids
+        self.columns = columns
+
+    @property
+    def nbytes(self) -> int:
+        return self.node_ids.nbytes + sum(c.nbytes for c in self.columns.values())
+
+    def lookup(self, node_ids: List[str]) -> np.ndarray:
+        return lookup_sorted(self.node_ids, node_ids)
+
+    def tags(self, index: int) -> str:
+        """Feature tag text for the node at index, e.g. 'degree:3 pagerank:0.2401 ...'"""
+        values = []
+        for name in FEATURE_NAMES:
+            value = self.columns[name][index]
+            if np.issubdtype(self.columns[name].dtype, np.integer):
+                values.append(f"{name}:{value}")
+            else:
+                values.append(f"{name}:{value:.4f}")
+        return " ".join(values)
+
+
+def save_features(db: Session, graph_id: str, node_ids: np.ndarray, features: Dict[str, np.ndarray]):
+    """Replace a graph's node_features rows (caller commits)"""
+    db.query(NodeFeature).filter(NodeFeature.graph_id == graph_id).delete(synchronize_session=False)
+    columns = [features[name].tolist() for name in FEATURE_NAMES]
+    ids = node_ids.tolist()
+    for start in range(0, len(ids), INSERT_CHUNK_ROWS):
+        stop = start + INSERT_CHUNK_ROWS
+        db.execute(insert(NodeFeature), [
+            {"graph_id": graph_id, "node_id": node_id, **dict(zip(FEATURE_NAMES, values))}
+            for node_id, *values in zip(ids[start:stop], *(c[start:stop] for c in columns))
+        ])
+
+
+def update_features(
+    db: Session,
+    graph_id: str,
+    node_ids: np.ndarray,
+    features: Dict[str, np.ndarray],
+    rows: np.ndarray,
+    new_rows: np.ndarray
+):
+    """Rewrite only the given feature rows, inserting the ones in new_rows (caller commits)"""
+    existing = rows[~np.isin(rows, new_rows)]
+    table = NodeFeature.__table__
+    # Core executemany: match rows by (graph_id, node_id) rather than primary key
+    statement = update(table).where(
+        table.c.graph_id == graph_id,
+        table.c.node_id == bindparam("b_node_id")
+    ).values({name: bindparam(name) for name in FEATURE_NAMES})
+
+    for start in range(0, len(existing), INSERT_CHUNK_ROWS):
+        chunk = existing[start:start + INSERT_CHUNK_ROWS]
+        db.execute(statement, [
+            {"b_node_id": str(node_ids[i]), **{n: features[n][i].item() for n in FEATURE_NAMES}}
+            for i in chunk.tolist()
+        ])
+    for start in range(0, len(new_rows), INSERT_CHUNK_ROWS):
+        chunk = new_rows[start:start + INSERT_CHUNK_ROWS]
+        db.execute(insert(NodeFeature), [
+            {"graph_id": graph_id, "node_id": str(node_ids[i]),
+             **{n: features[n][i].item() for n in FEATURE_NAMES}}
+            for i in chunk.tolist()
+        ])
+
+
+def load_features(db: Session, graph_id: str) -> Optional[NodeFeatures]:
+    """Load a graph's stored features, or None if the feature stage has not run"""
+    rows = db.query(
+        NodeFeature.node_id, *(getattr(NodeFeature, name) for name in FEATURE_NAMES)
+    ).filter(NodeFeature.graph_id == graph_id).all()
+    if not rows:
+        return None
+
+    columns = list(zip(*rows))
+    node_ids = np.array(columns[0], dtype=str)
+    order = np.argsort(node_ids, kind="stable")
+    return NodeFeatures(node_ids[order], {
+        name: np.array(values)[order] for name, values in zip(FEATURE_NAMES, columns[1:])
+    })
+
+
+# Shared by the serializers, keyed by (graph_id, feature version)
+_feature_cache = LRUCache(
+    max_entries=settings.GRAPH_CACHE_ENTRIES,
+    max_bytes=settings.GRAPH_CACHE_MB * 1024 * 1024,
+    sizeof=lambda features: features.nbytes
+)
+register_invalidation_hook(
+    FEATURE_SCOPE,
+    lambda graph_id, node_ids: _feature_cache.discard_where(lambda key: key[0] == graph_id)
+)
+
+
+def cache_features(graph_id: str, node_ids: np.ndarray, features: Dict[str, np.ndarray]):
+    """Cache features just written for a graph (node_ids sorted) under its current version"""
+    key = (graph_id, graph_version(graph_id, FEATURE_SCOPE))
+    _feature_cache.put(key, NodeFeatures(node_ids, {name: features[name] for name in FEATURE_NAMES}))
+
+
+def get_features(db: Session, graph_id: str) -> Optional[NodeFeatures]:
+    """Return the cached stored features of a graph, loading them on first use"""
+    key = (graph_id, graph_version(graph_id, FEATURE_SCOPE))
+    return _feature_cache.get_or_build(key, lambda: load_features(db, graph_id))
+# Sparse-matrix structural features
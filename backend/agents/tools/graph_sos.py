@@ -1,8 +1,36 @@
 # agents/tools/graph_sos.py
-import networkx as nx
+import numpy as np
 from sqlalchemy.orm import Session
-from typing import List, Set
-from models.graph import Node, Edge, NodeText
+from typing import List, Optional
+from agents.tools.fragment_store import get_fragments
+from agents.tools.graph_store import GraphAdjacency, get_adjacency
+from core.config import settings
+from utils.cache import ALL_SCOPES, LRUCache, graph_version, register_invalidation_hook
+from utils.tokens import count_node_tokens
+
+# Longest seed-to-node path rendered into the context
+MAX_PATH_NODES = 4
+
+# Candidate nodes whose fragments are fetched per lookup
+FRAGMENT_CHUNK = 64
+
+# Serialized contexts, keyed by (graph_id, graph_version, seeds, hops, budget)
+_context_cache = LRUCache(
+    max_entries=settings.CONTEXT_CACHE_ENTRIES,
+    max_bytes=settings.CONTEXT_CACHE_MB * 1024 * 1024,
+    sizeof=lambda context: len(context.encode())
+)
+for _scope in ALL_SCOPES:
+    register_invalidation_hook(
+        _scope,
+        lambda graph_id, node_ids: _context_cache.discard_where(lambda key: key[0] == graph_id)
+    )
+
+
+def context_cache_stats():
+    """Hit/miss/eviction counters of the serialized-context cache"""
+    return _context_cache.stats()
+
 
 class GraphSOS:
     """Graph Serialization with Order Sensitivity"""
@@ -12,98 +40,179 @@ class GraphSOS:
         db: Session,
         graph_id: str,
         seed_nodes: List[str],
-        hops: int = 2
+        hops: int = 2,
+        max_context_tokens: Optional[int] = None
     ) -> str:
-        """Serialize subgraph with order-sensitive paths"""
-        
-        # Build NetworkX graph
-        G = self._build_graph(db, graph_id)
-        
-        # Expand from seed nodes
-        expanded_nodes = self._expand_nodes(G, seed_nodes, hops)
+        """Serialize subgraph with order-sensitive paths, packed into a token budget.
         
-        # Get paths between nodes
-        paths = self._get_paths(G, expanded_nodes)
+        Nodes rank by hop distance, then by the retrieval rank of the seed they
+        were reached from. Each node's line is followed by its path back to that
+        seed. Lines are packed greedily in that order, skipping any line that no
+        longer fits, until max_context_tokens is used up.
+        """
+        budget = settings.CONTEXT_MAX_TOKENS if max_context_tokens is None else max_context_tokens
         
-        # Serialize to text
-        context_parts = []
-        
-        # Add node texts
-        node_texts = db.query(NodeText).filter(
-            NodeText.graph_id == graph_id,
-            NodeText.node_id.in_(expanded_nodes)
-        ).all()
+        # Seed order is part of the key: it decides ranking and therefore output
+        key = (graph_id, graph_version(graph_id), tuple(seed_nodes), hops, budget)
+        return _context_cache.get_or_build(
+            key, lambda: self._serialize(db, graph_id, seed_nodes, hops, budget)
+        )
+    
+    def _serialize(
+        self,
+        db: Session,
+        graph_id: str,
+        seed_nodes: List[str],
+        hops: int,
+        budget: int
+    ) -> str:
+        # Shared, cached adjacency (rebuilt only after uploads)
+        adjacency = get_adjacency(db, graph_id)
         
-        for nt in node_texts[:10]:  # Limit for context size
-            context_parts.append(f"Node {nt.node_id}: {nt.text[:200]}")
+        # One bounded multi-source BFS from the seeds (in retrieval order)
+        seed_idx = adjacency.lookup(seed_nodes)
+        traversal = self._expand_layers(adjacency, seed_idx, hops)
         
-        # Add path information
-        for path in paths[:5]:  # Limit paths
-            path_str = " → ".join(path)
-            context_parts.append(f"Path: {path_str}")
+        # (hop, seed rank, node id, position in layer); node ids sort like indices
+        candidates = [
+            (hop, root, str(adjacency.node_ids[node]), position)
+            for hop, (layer, roots) in enumerate(zip(traversal.layers, traversal.roots))
+            for position, (node, root) in enumerate(zip(layer.tolist(), roots.tolist()))
+        ]
+        # Seeds with text but no edges are not in the adjacency
+        candidates.extend(
+            (0, rank, node_id, None)
+            for rank, (node_id, index) in enumerate(zip(seed_nodes, seed_idx))
+            if index < 0 and node_id not in seed_nodes[:rank]
+        )
+        candidates.sort()
         
-        return "\n".join(context_parts)
-    
-    def _build_graph(self, db: Session, graph_id: str) -> nx.Graph:
-        """Build NetworkX graph from database"""
-        G = nx.Graph()
+        node_lines, path_lines = [], []
+        used = 0
         
-        # Add nodes
-        nodes = db.query(Node).filter(Node.graph_id == graph_id).all()
-        for node in nodes:
-            G.add_node(node.node_id, label=node.label)
+        def pack(line: str, tokens: int, lines: List[str]):
+            nonlocal used
+            # Every line after the first also costs its "\n" separator
+            cost = tokens + (1 if node_lines or path_lines else 0)
+            if used + cost <= budget:
+                lines.append(line)
+                used += cost
         
-        # Add edges
-        edges = db.query(Edge).filter(Edge.graph_id == graph_id).all()
-        for edge in edges:
-            G.add_edge(edge.src, edge.dst, relation=edge.relation)
+        # Node lines come from the fragment cache, fetched a chunk at a time so
+        # only nodes that can still make it into the budget are looked up
+        for start in range(0, len(candidates), FRAGMENT_CHUNK):
+            chunk = candidates[start:start + FRAGMENT_CHUNK]
+            fragments = get_fragments(db, graph_id, [node_id for _, _, node_id, _ in chunk])
+            for hop, _, node_id, position in chunk:
+                if used >= budget:
+                    break
+                line, tokens = fragments[node_id]
+                if line is not None:
+                    pack(line, tokens, node_lines)
+                if 0 < hop < MAX_PATH_NODES:
+                    path = self._path_to(adjacency, traversal, hop, position)
+                    line = f"Path: {' → '.join(path)}"
+                    pack(line, count_node_tokens(line), path_lines)
+            if used >= budget:
+                break
         
-        return G
+        return "\n".join(node_lines + path_lines)
     
-    def _expand_nodes(
+    def _expand_layers(
         self,
-        G: nx.Graph,
-        seed_nodes: List[str],
+        adjacency: GraphAdjacency,
+        seed_idx: np.ndarray,
         hops: int
-    ) -> Set[str]:
-        """Expand nodes by k hops"""
-        expanded = set(seed_nodes)
-        current_layer = set(seed_nodes)
+    ) -> "Traversal":
+        """Multi-source BFS from the seeds, one vectorized CSR slice per hop.
         
-        for _ in range(hops):
-            next_layer = set()
-            for node in current_layer:
-                if node in G:
-                    neighbors = G.neighbors(node)
-                    next_layer.update(neighbors)
-            expanded.update(next_layer)
-            current_layer = next_layer
+        seed_idx is in retrieval order (-1 for ids not in the graph). At most
+        GRAPHSOS_MAX_FANOUT neighbours are followed per node, and at most
+        GRAPHSOS_HOP_NODE_BUDGET new nodes are admitted per hop, preferring
+        those linked from the most frontier nodes. Each admitted node keeps the
+        parent whose seed ranks best, so paths are deterministic.
+        """
+        fanout = settings.GRAPHSOS_MAX_FANOUT
+        budget = settings.GRAPHSOS_HOP_NODE_BUDGET
         
-        return expanded
-    
-    def _get_paths(
-        self,
-        G: nx.Graph,
-        nodes: Set[str],
-        max_paths: int = 10
-    ) -> List[List[str]]:
-        """Get paths between nodes"""
-        paths = []
-        node_list = list(nodes)
+        # Layer 0: distinct seeds, each with its best retrieval rank
+        ranks = np.flatnonzero(seed_idx >= 0)
+        frontier, first = np.unique(seed_idx[ranks], return_index=True)
+        frontier = frontier.astype(np.int64)
+        traversal = Traversal(frontier, np.full(len(frontier), -1, dtype=np.int64), ranks[first])
+        visited = np.zeros(adjacency.num_nodes, dtype=bool)
+        visited[frontier] = True
         
-        for i, src in enumerate(node_list):
-            if i >= 5:  # Limit source nodes
+        for _ in range(hops):
+            if len(frontier) == 0:
+                break
+            
+            starts = adjacency.indptr[frontier].astype(np.int64)
+            take = np.minimum(adjacency.indptr[frontier + 1] - starts, fanout)
+            total = int(take.sum())
+            if total == 0:
+                break
+            
+            # Flat positions of the first `take` neighbours of every frontier node
+            shift = starts - (np.cumsum(take) - take)
+            positions = np.repeat(shift, take) + np.arange(total)
+            reached = adjacency.indices[positions].astype(np.int64)
+            sources = np.repeat(frontier, take)
+            source_roots = np.repeat(traversal.roots[-1], take)
+            fresh = ~visited[reached]
+            reached, sources, source_roots = reached[fresh], sources[fresh], source_roots[fresh]
+            if len(reached) == 0:
                 break
-            for dst in node_list[i+1:i+3]:  # Limit destinations
-                if src in G and dst in G:
-                    try:
-                        path = nx.shortest_path(G, src, dst)
-                        if len(path) > 1 and len(path) <= 4:
-                            paths.append(path)
-                    except nx.NetworkXNoPath:
-                        pass
-                    
-                    if len(paths) >= max_paths:
-                        return paths
+            
+            # Best (seed rank, parent index) link per reached node comes first
+            order = np.lexsort((sources, source_roots, reached))
+            reached, sources, source_roots = reached[order], sources[order], source_roots[order]
+            frontier, first, links = np.unique(reached, return_index=True, return_counts=True)
+            parents, roots = sources[first], source_roots[first]
+            
+            if len(frontier) > budget:
+                keep = np.sort(np.lexsort((frontier, -links))[:budget])
+                frontier, parents, roots = frontier[keep], parents[keep], roots[keep]
+            
+            visited[frontier] = True
+            traversal.add_layer(frontier, parents, roots)
         
-        return paths# Order-sensitive serialization + sampling
+        return traversal
+    
+    def _path_to(
+        self,
+        adjacency: GraphAdjacency,
+        traversal: "Traversal",
+        hop: int,
+        position: int
+    ) -> List[str]:
+        """BFS path from the seed to the node at layers[hop][position]"""
+        path = []
+        while True:
+            node = traversal.layers[hop][position]
+            path.append(str(adjacency.node_ids[node]))
+            parent = traversal.parents[hop][position]
+            if parent < 0:
+                return path[::-1]
+            hop -= 1
+            position = int(np.searchsorted(traversal.layers[hop], parent))
+
+
+class Traversal:
+    """BFS layers from a seed set.
+    
+    layers[h] are the sorted node indices first reached at hop h. parents[h]
+    and roots[h] align with them: the BFS parent (-1 for seeds) and the
+    retrieval rank of the seed the node was reached from.
+    """
+    
+    def __init__(self, seeds: np.ndarray, parents: np.ndarray, roots: np.ndarray):
+        self.layers = [seeds]
+        self.parents = [parents]
+        self.roots = [roots]
+    
+    def add_layer(self, nodes: np.ndarray, parents: np.ndarray, roots: np.ndarray):
+        self.layers.append(nodes)
+        self.parents.append(parents)
+        self.roots.append(roots)
+# Order-sensitive serialization + sampling
@@ -0,0 +1,262 @@
+# agents/tools/graph_store.py
+import numpy as np
+from scipy.sparse import csr_matrix
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from core.config import settings
+from models.graph import Node, Edge
+from utils.cache import LRUCache, STRUCTURE_SCOPE, graph_version, register_invalidation_hook
+
+
+def lookup_sorted(table: np.ndarray, node_ids: List[str]) -> np.ndarray:
+    """Positions of node_ids in a sorted id table, -1 where absent"""
+    if not len(node_ids) or not len(table):
+        return np.full(len(node_ids), -1, dtype=np.int64)
+    ids = np.asarray(node_ids, dtype=str)
+    positions = np.searchsorted(table, ids)
+    positions[positions >= len(table)] = 0
+    found = table[positions] == ids
+    return np.where(found, positions, -1)
+
+
+class GraphAdjacency:
+    """Compact undirected adjacency for one graph.
+
+    Nodes are interned into a sorted id table, so node index i is node_ids[i]
+    and lookups are a binary search. Neighbours of i are
+    indices[indptr[i]:indptr[i + 1]] (sorted), with the edge relation of each
+    entry in relation_ids (an index into relations). Parallel edges are
+    collapsed, keeping the first relation seen, like nx.Graph.
+    """
+
+    def __init__(
+        self,
+        node_ids: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        relation_ids: np.ndarray,
+        relations: np.ndarray,
+        max_node_id: int = 0,
+        max_edge_id: int = 0
+    ):
+        self.node_ids = node_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.relation_ids = relation_ids
+        self.relations = relations
+        # Highest Node.id / Edge.id included; rows are append-only, so rows
+        # above these are exactly what a patch has to add
+        self.max_node_id = max_node_id
+        self.max_edge_id = max_edge_id
+        self._matrix = None
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self) -> int:
+        """Undirected edge count (self-loops are stored once, other edges twice)"""
+        rows = np.repeat(np.arange(self.num_nodes), np.diff(self.indptr))
+        self_loops = int(np.count_nonzero(rows == self.indices))
+        return (len(self.indices) - self_loops) // 2 + self_loops
+
+    @property
+    def degrees(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.node_ids, self.indptr, self.indices, self.relation_ids, self.relations]
+        return sum(a.nbytes for a in arrays)
+
+    def lookup(self, node_ids: List[str]) -> np.ndarray:
+        """Node indices for the given ids, -1 where the id is not in the graph"""
+        return lookup_sorted(self.node_ids, node_ids)
+
+    def neighbors(self, index: int) -> np.ndarray:
+        return self.indices[self.indptr[index]:self.indptr[index + 1]]
+
+    def to_scipy(self) -> csr_matrix:
+        """Binary adjacency matrix sharing the index arrays (built once)"""
+        if self._matrix is None:
+            self._matrix = csr_matrix(
+                (np.ones(len(self.indices), dtype=np.float32), self.indices, self.indptr),
+                shape=(self.num_nodes, self.num_nodes)
+            )
+        return self._matrix
+
+
+def _load_rows(db: Session, graph_id: str, min_node_id: int = 0, min_edge_id: int = 0):
+    """Declared node ids and edge (src, dst, relation) columns above the given row ids,
+    plus the highest row ids seen"""
+    node_rows = db.query(Node.id, Node.node_id).filter(
+        Node.graph_id == graph_id,
+        Node.id > min_node_id
+    ).all()
+    edge_rows = db.query(Edge.id, Edge.src, Edge.dst, Edge.relation).filter(
+        Edge.graph_id == graph_id,
+        Edge.id > min_edge_id
+    ).all()
+
+    declared = np.array([row[1] for row in node_rows], dtype=str)
+    if edge_rows:
+        src, dst, rel = (np.array(column, dtype=str) for column in list(zip(*edge_rows))[1:])
+    else:
+        src = dst = rel = np.empty(0, dtype=str)
+    max_node_id = max((row[0] for row in node_rows), default=min_node_id)
+    max_edge_id = max((row[0] for row in edge_rows), default=min_edge_id)
+    return declared, src, dst, rel, max_node_id, max_edge_id
+
+
+def build_adjacency(db: Session, graph_id: str) -> GraphAdjacency:
+    """Load nodes and edges of a graph and pack them into CSR form"""
+    declared, src, dst, rel, max_node_id, max_edge_id = _load_rows(db, graph_id)
+
+    # Intern ids: every declared node plus every edge endpoint
+    node_table, inverse = np.unique(np.concatenate([declared, src, dst]), return_inverse=True)
+    n = len(node_table)
+    src_idx = inverse[len(declared):len(declared) + len(src)]
+    dst_idx = inverse[len(declared) + len(src):]
+    relations, rel_idx = np.unique(rel, return_inverse=True)
+
+    # Symmetrise, then dedupe (row, col) pairs; np.unique sorts keys into CSR order
+    rows = np.concatenate([src_idx, dst_idx]).astype(np.int64)
+    cols = np.concatenate([dst_idx, src_idx]).astype(np.int64)
+    rel_all = np.concatenate([rel_idx, rel_idx])
+    _, first = np.unique(rows * max(n, 1) + cols, return_index=True)
+
+    index_dtype = np.int32 if len(first) < np.iinfo(np.int32).max else np.int64
+    indptr = np.zeros(n + 1, dtype=index_dtype)
+    np.cumsum(np.bincount(rows[first], minlength=n), out=indptr[1:])
+
+    return GraphAdjacency(
+        node_ids=node_table,
+        indptr=indptr,
+        indices=cols[first].astype(np.int32),
+        relation_ids=rel_all[first].astype(np.int32),
+        relations=relations,
+        max_node_id=max_node_id,
+        max_edge_id=max_edge_id
+    )
+
+
+def patch_adjacency(db: Session, graph_id: str, base: GraphAdjacency) -> GraphAdjacency:
+    """base plus the nodes and edges added since it was built.
+
+    Only the new rows are read from the database. The existing CSR arrays
+    are remapped and spliced rather than re-sorted, and pairs that were
+    already connected keep their relation, as in build_adjacency.
+    """
+    declared, src, dst, rel, max_node_id, max_edge_id = _load_rows(
+        db, graph_id, base.max_node_id, base.max_edge_id
+    )
+    if not len(declared) and not len(src):
+        return base
+
+    # New ids merge into the sorted table; old indices shift by the new ids before them
+    candidates = np.unique(np.concatenate([declared, src, dst]))
+    added = candidates[base.lookup(candidates.tolist()) < 0]
+    node_table = base.node_ids
+    remap = None
+    if len(added):
+        # Widen the string dtype first: np.insert would truncate longer ids
+        widened = base.node_ids.astype(np.result_type(base.node_ids, added))
+        node_table = np.insert(widened, np.searchsorted(base.node_ids, added), added)
+        remap = np.arange(base.num_nodes, dtype=np.int64) + np.searchsorted(added, base.node_ids)
+    n = len(node_table)
+
+    relations = base.relations
+    old_rel_ids = base.relation_ids
+    new_relations = np.setdiff1d(rel, base.relations)
+    if len(new_relations):
+        relations = np.union1d(base.relations, new_relations)
+        old_rel_ids = np.searchsorted(relations, base.relations)[base.relation_ids].astype(np.int32)
+
+    # Existing entries in the new numbering; keys stay sorted since remap is increasing
+    old_rows = np.repeat(np.arange(base.num_nodes, dtype=np.int64), np.diff(base.indptr))
+    old_cols = base.indices
+    if remap is not None:
+        old_rows = remap[old_rows]
+        old_cols = remap[old_cols].astype(np.int32)
+    old_keys = old_rows * n + old_cols
+
+    # New entries: symmetrised, deduped (first relation wins), minus pairs already present
+    src_idx = lookup_sorted(node_table, src.tolist())
+    dst_idx = lookup_sorted(node_table, dst.tolist())
+    rel_idx = np.searchsorted(relations, rel)
+    rows = np.concatenate([src_idx, dst_idx]).astype(np.int64)
+    cols = np.concatenate([dst_idx, src_idx]).astype(np.int64)
+    rel_all = np.concatenate([rel_idx, rel_idx])
+    keys, first = np.unique(rows * n + cols, return_index=True)
+    positions = np.searchsorted(old_keys, keys)
+    present = np.zeros(len(keys), dtype=bool)
+    inside = positions < len(old_keys)
+    present[inside] = old_keys[positions[inside]] == keys[inside]
+    first, positions = first[~present], positions[~present]
+
+    counts = np.bincount(rows[first], minlength=n)
+    if remap is not None:
+        counts[remap] += np.diff(base.indptr)
+    else:
+        counts += np.diff(base.indptr)
+    total = int(counts.sum())
+    index_dtype = np.int32 if total < np.iinfo(np.int32).max else np.int64
+    indptr = np.zeros(n + 1, dtype=index_dtype)
+    np.cumsum(counts, out=indptr[1:])
+
+    return GraphAdjacency(
+        node_ids=node_table,
+        indptr=indptr,
+        indices=np.insert(old_cols, positions, cols[first].astype(np.int32)),
+        relation_ids=np.insert(old_rel_ids, positions, rel_all[first].astype(np.int32)),
+        relations=relations,
+        max_node_id=max_node_id,
+        max_edge_id=max_edge_id
+    )
+
+
+# Shared by GraphSOS and GNNAdapter, keyed by (graph_id, graph_version)
+_adjacency_cache = LRUCache(
+    max_entries=settings.GRAPH_CACHE_ENTRIES,
+    max_bytes=settings.GRAPH_CACHE_MB * 1024 * 1024,
+    sizeof=lambda adjacency: adjacency.nbytes
+)
+# Adjacencies superseded by an upload, kept as the base of the next patch
+_patch_bases = LRUCache(
+    max_entries=settings.GRAPH_CACHE_ENTRIES,
+    max_bytes=settings.GRAPH_CACHE_MB * 1024 * 1024,
+    sizeof=lambda adjacency: adjacency.nbytes
+)
+
+
+def _invalidate(graph_id: str, node_ids):
+    superseded = _adjacency_cache.pop_where(lambda key: key[0] == graph_id)
+    if superseded:
+        _patch_bases.put(graph_id, max(superseded, key=lambda adjacency: adjacency.max_edge_id))
+
+
+register_invalidation_hook(STRUCTURE_SCOPE, _invalidate)
+
+
+def _load_adjacency(db: Session, graph_id: str) -> GraphAdjacency:
+    base = _patch_bases.pop(graph_id)
+    if base is None:
+        return build_adjacency(db, graph_id)
+    return patch_adjacency(db, graph_id, base)
+
+
+def get_adjacency(db: Session, graph_id: str) -> Optional[GraphAdjacency]:
+    """Return the cached adjacency for a graph, building it on first use.
+
+    After an upload the previous adjacency is patched with the new rows
+    instead of being rebuilt from every edge.
+    """
+    key = (graph_id, graph_version(graph_id, STRUCTURE_SCOPE))
+    return _adjacency_cache.get_or_build(key, lambda: _load_adjacency(db, graph_id))
+
+
+def adjacency_cache_stats():
+    """Hit/miss/eviction counters of the adjacency cache"""
+    return _adjacency_cache.stats()
+# Cached CSR adjacency per graph
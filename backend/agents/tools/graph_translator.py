@@ -1,8 +1,9 @@
 # agents/tools/graph_translator.py
 from sqlalchemy.orm import Session
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import json
 from models.run import Artifact
+from utils.jobs import ProgressCallback
 
 class GraphTranslator:
     """Align graph structure to LLM token space"""
@@ -11,9 +12,12 @@ class GraphTranslator:
         self,
         db: Session,
         graph_id: str,
-        run_id: str
+        run_id: str,
+        progress: Optional[ProgressCallback] = None
     ) -> Dict[str, Any]:
         """Create alignment hints for token-friendly serialization"""
+        report = progress or (lambda fraction, message: None)
+        report(0.0, "building templates")
         
         # Placeholder: Create serialization templates
         alignment_hints = {
@@ -30,6 +34,7 @@ class GraphTranslator:
         }
         
         # Save as artifact
+        report(0.5, "saving alignment")
         artifact = Artifact(
             run_id=run_id,
             kind="translator_alignment",
@@ -1,15 +1,90 @@
 # agents/tools/llm_client.py
+import asyncio
 import httpx
 import json
 import logging
-from typing import Dict, Any, Optional
+import threading
+import time
+from typing import AsyncIterator, Dict, Any, Optional, Tuple
+from agents.tools.rate_limiter import backoff, get_limiter, is_retryable, retry_after
+from agents.tools.response_cache import cache_key, response_cache, should_cache
 from core.config import settings
+from utils.cache import SingleFlight
 from utils.tokens import estimate_tokens, estimate_cost
 
 # Set up detailed logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# One pooled HTTP client per process (per event loop for the async one), so
+# generations reuse keep-alive connections instead of paying TCP+TLS each call
+_sync_client: Optional[httpx.Client] = None
+_sync_client_lock = threading.Lock()
+_async_clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+
+# Identical generations in flight at the same time share one provider call
+_inflight = SingleFlight()
+
+
+def _client_options() -> Dict[str, Any]:
+    return {
+        "timeout": settings.LLM_TIMEOUT,
+        "limits": httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY
+        )
+    }
+
+
+def _http2_available() -> bool:
+    if not settings.LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.info("h2 not installed; LLM requests use HTTP/1.1 (pip install 'httpx[http2]')")
+        return False
+
+
+def get_http_client() -> httpx.Client:
+    """Shared blocking client for LLMClient"""
+    global _sync_client
+    with _sync_client_lock:
+        if _sync_client is None or _sync_client.is_closed:
+            _sync_client = httpx.Client(**_client_options())
+        return _sync_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Shared HTTP/2 client for AsyncLLMClient, bound to the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(http2=_http2_available(), **_client_options())
+        _async_clients[loop] = client
+    return client
+
+
+def inflight_stats() -> Dict[str, Any]:
+    """Provider calls made vs. requests that shared an in-flight call"""
+    return _inflight.stats()
+
+
+async def close_http_clients():
+    """Close the pooled clients (app shutdown)"""
+    global _sync_client
+    loop = asyncio.get_running_loop()
+    client = _async_clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+    with _sync_client_lock:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
+
+
 class LLMClient:
     def __init__(self):
         self.provider = settings.LLM_PROVIDER
@@ -21,7 +96,7 @@ class LLMClient:
         self.max_tokens = settings.LLM_MAX_TOKENS
         
         # Debug logging
-        logger.info(f"=== LLMClient Initialization ===")
+        logger.info(f"=== {type(self).__name__} Initialization ===")
         logger.info(f"Provider: {self.provider}")
         logger.info(f"Endpoint: {self.endpoint_base}")
         logger.info(f"Model: {self.model}")
@@ -29,7 +104,60 @@ class LLMClient:
         logger.info(f"API Key prefix: {self.api_key[:10] if self.api_key else 'None'}...")
     
     def send(self, prompt: str, params: Dict[str, Any] = {}) -> Dict[str, Any]:
-        """Send prompt to LLM and return response"""
+        """Send prompt to LLM and return response.
+        
+        params["cache"] = True/False forces/disables the response cache, which
+        otherwise only serves temperature 0 requests.
+        """
+        params, key, cache = self._request_key(prompt, params)
+        cacheable = self._cacheable(params, cache)
+        cached = response_cache.get(key) if cacheable else None
+        if cached is not None:
+            logger.info("LLM response cache hit")
+            return cached
+        
+        start = time.perf_counter()
+        result, ok = self._fetch(prompt, params)
+        if ok and cacheable:
+            response_cache.put(key, result, (time.perf_counter() - start) * 1000)
+        return result
+    
+    def _fetch(self, prompt: str, params: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """Uncached request: (result, whether it succeeded)"""
+        url, headers, payload, model = self._build_request(prompt, params)
+        
+        try:
+            logger.info("Sending HTTP request...")
+            response = get_http_client().post(url, json=payload, headers=headers)
+            data = self._check_response(response)
+            return self._parse_response(data, prompt, model), True
+        except httpx.HTTPStatusError as e:
+            return self._status_error(e), False
+        except Exception as e:
+            return self._unexpected_error(e), False
+    
+    def _request_key(self, prompt: str, params: Dict[str, Any]) -> Tuple[Dict[str, Any], str, Optional[bool]]:
+        """(params without the cache flag, content key of the request, cache flag)"""
+        params = dict(params)
+        cache = params.pop("cache", None)
+        sampling = {
+            **params,
+            "temperature": params.get("temperature", self.temperature),
+            "top_p": params.get("top_p", self.top_p),
+            "max_tokens": params.get("max_tokens", self.max_tokens)
+        }
+        model = sampling.pop("model", self.model)
+        return params, cache_key(self.provider, model, sampling, prompt), cache
+    
+    def _cacheable(self, params: Dict[str, Any], cache: Optional[bool]) -> bool:
+        return should_cache(params.get("temperature", self.temperature), cache)
+    
+    def _build_request(
+        self,
+        prompt: str,
+        params: Dict[str, Any]
+    ) -> Tuple[str, Dict[str, str], Dict[str, Any], str]:
+        """(url, headers, payload, model) for the configured provider"""
         
         logger.info(f"=== Sending LLM Request ===")
         logger.debug(f"Prompt: {prompt[:100]}...")
@@ -67,76 +195,267 @@ class LLMClient:
             headers = {"Authorization": f"Bearer {self.api_key}"}
             payload = {"prompt": prompt, "params": params}
         
+        return url, headers, payload, model
+    
+    def _check_response(self, response: httpx.Response) -> Dict[str, Any]:
+        logger.info(f"Response Status: {response.status_code} ({response.http_version})")
+        logger.debug(f"Response Headers: {response.headers}")
+        
+        if response.status_code != 200:
+            logger.error(f"Non-200 response: {response.text}")
+        
+        response.raise_for_status()
+        data = response.json()
+        logger.debug(f"Response data: {json.dumps(data, indent=2)[:500]}...")
+        return data
+    
+    def _parse_response(self, data: Dict[str, Any], prompt: str, model: str) -> Dict[str, Any]:
+        # Parse response based on provider
+        if self.provider in ["openrouter", "openai"]:
+            answer_text = data["choices"][0]["message"]["content"]
+            usage = data.get("usage", {})
+            prompt_tokens = usage.get("prompt_tokens", estimate_tokens(prompt))
+            completion_tokens = usage.get("completion_tokens", estimate_tokens(answer_text))
+        else:
+            answer_text = data.get("text", "")
+            prompt_tokens = estimate_tokens(prompt)
+            completion_tokens = estimate_tokens(answer_text)
+        
+        total_tokens = prompt_tokens + completion_tokens
+        est_cost_usd = estimate_cost(prompt_tokens, completion_tokens, model)
+        
+        logger.info(f"Success! Tokens: {total_tokens}, Cost: ${est_cost_usd:.4f}")
+        
+        return {
+            "answer_text": answer_text,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": total_tokens,
+            "est_cost_usd": est_cost_usd,
+            "confidence": None,
+            "llm_pred_label": None
+        }
+    
+    def _status_error(self, e: httpx.HTTPStatusError) -> Dict[str, Any]:
+        logger.error(f"HTTP Status Error: {e}")
+        logger.error(f"Response Status: {e.response.status_code}")
+        logger.error(f"Response Body: {e.response.text}")
+        
+        error_detail = "Unknown error"
         try:
-            logger.info("Sending HTTP request...")
-            with httpx.Client(timeout=60.0) as client:
-                response = client.post(url, json=payload, headers=headers)
-                
-                logger.info(f"Response Status: {response.status_code}")
-                logger.debug(f"Response Headers: {response.headers}")
-                
-                if response.status_code != 200:
-                    logger.error(f"Non-200 response: {response.text}")
-                
-                response.raise_for_status()
-                data = response.json()
-                logger.debug(f"Response data: {json.dumps(data, indent=2)[:500]}...")
-            
-            # Parse response based on provider
-            if self.provider in ["openrouter", "openai"]:
-                answer_text = data["choices"][0]["message"]["content"]
-                usage = data.get("usage", {})
-                prompt_tokens = usage.get("prompt_tokens", estimate_tokens(prompt))
-                completion_tokens = usage.get("completion_tokens", estimate_tokens(answer_text))
-            else:
-                answer_text = data.get("text", "")
-                prompt_tokens = estimate_tokens(prompt)
-                completion_tokens = estimate_tokens(answer_text)
-            
-            total_tokens = prompt_tokens + completion_tokens
-            est_cost_usd = estimate_cost(prompt_tokens, completion_tokens, model)
-            
-            logger.info(f"Success! Tokens: {total_tokens}, Cost: ${est_cost_usd:.4f}")
-            
-            return {
-                "answer_text": answer_text,
-                "prompt_tokens": prompt_tokens,
-                "completion_tokens": completion_tokens,
-                "total_tokens": total_tokens,
-                "est_cost_usd": est_cost_usd,
-                "confidence": None,
-                "llm_pred_label": None
+            error_json = e.response.json()
+            error_detail = error_json.get("error", {}).get("message", str(error_json))
+        except:
+            error_detail = e.response.text
+        
+        return self._error_result(
+            f"OpenAI API Error {e.response.status_code}: {error_detail}",
+            e.response.status_code
+        )
+    
+    def _unexpected_error(self, e: Exception) -> Dict[str, Any]:
+        logger.error(f"Unexpected error: {type(e).__name__}: {str(e)}", exc_info=True)
+        return self._error_result(f"Error: {type(e).__name__}: {str(e)}")
+    
+    def _error_result(self, answer_text: str, status_code: Optional[int] = None) -> Dict[str, Any]:
+        """Failed generation; "error" marks it so callers don't treat the text as an answer"""
+        return {
+            "answer_text": answer_text,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+            "est_cost_usd": 0.0,
+            "confidence": None,
+            "llm_pred_label": None,
+            "error": answer_text,
+            "error_status": status_code
+        }
+
+class AsyncLLMClient(LLMClient):
+    """LLMClient whose send is a coroutine on the shared HTTP/2 connection pool.
+    
+    Awaiting a generation holds no worker thread, so one process can keep
+    many generations in flight (bounded by LLM_MAX_CONNECTIONS).
+    """
+    
+    async def send(self, prompt: str, params: Dict[str, Any] = {}) -> Dict[str, Any]:
+        """Send prompt to LLM and return response (cached like LLMClient.send).
+        
+        Identical cacheable requests (temperature 0, or params["cache"] True)
+        arriving while one is in flight await that call instead of sending
+        their own. They get its result with cost 0 and coalesced=True; sampled
+        requests always draw their own completion.
+        """
+        params, key, cache = self._request_key(prompt, params)
+        cacheable = self._cacheable(params, cache)
+        cached = await response_cache.aget(key) if cacheable else None
+        if cached is not None:
+            logger.info("LLM response cache hit")
+            return cached
+        
+        async def fetch() -> Dict[str, Any]:
+            start = time.perf_counter()
+            result, ok = await self._fetch(prompt, params)
+            if ok and cacheable:
+                await response_cache.aput(key, result, (time.perf_counter() - start) * 1000)
+            return result
+        
+        if not self._coalescable(params, cache):
+            return await fetch()
+        
+        result, shared = await _inflight.do(key, fetch)
+        if shared and not result.get("error"):
+            logger.info("LLM request coalesced with an identical in-flight call")
+            result = {
+                **result,
+                "est_cost_usd": 0.0,
+                "coalesced": True,
+                "saved_cost_usd": result.get("est_cost_usd") or 0.0
             }
+        return result
+    
+    def _coalescable(self, params: Dict[str, Any], cache: Optional[bool]) -> bool:
+        """Same reuse rule as the cache (independent of LLM_CACHE_ENABLED)"""
+        if not settings.LLM_COALESCE_REQUESTS or cache is False:
+            return False
+        temperature = params.get("temperature", self.temperature)
+        return bool(cache) or temperature <= 0 or settings.LLM_CACHE_NONZERO_TEMPERATURE
+    
+    async def _fetch(self, prompt: str, params: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """Uncached request admitted by the provider/model limiter.
+        
+        429/5xx responses and connection errors are retried up to
+        LLM_MAX_RETRIES times, after Retry-After when given, else backoff.
+        """
+        url, headers, payload, model = self._build_request(prompt, params)
+        limiter = get_limiter(self.provider, model)
+        tokens = self._token_estimate(prompt, params)
+        
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            last = attempt == settings.LLM_MAX_RETRIES
+            async with limiter.slot(tokens) as admission:
+                try:
+                    logger.info("Sending HTTP request...")
+                    response = await get_async_http_client().post(url, json=payload, headers=headers)
+                except httpx.TransportError as e:
+                    if last:
+                        return self._unexpected_error(e), False
+                    delay = backoff(attempt)
+                except Exception as e:
+                    return self._unexpected_error(e), False
+                else:
+                    if is_retryable(response.status_code) and not last:
+                        wait = retry_after(response)
+                        limiter.throttle(wait)
+                        # A Retry-After pause holds every request in the limiter
+                        delay = 0.0 if wait else backoff(attempt)
+                    else:
+                        try:
+                            data = self._check_response(response)
+                            result = self._parse_response(data, prompt, model)
+                        except httpx.HTTPStatusError as e:
+                            if is_retryable(e.response.status_code):
+                                limiter.throttle(retry_after(e.response))
+                            return self._status_error(e), False
+                        except Exception as e:
+                            return self._unexpected_error(e), False
+                        admission.succeeded(result["total_tokens"])
+                        return result, True
             
-        except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP Status Error: {e}")
-            logger.error(f"Response Status: {e.response.status_code}")
-            logger.error(f"Response Body: {e.response.text}")
-            
-            error_detail = "Unknown error"
+            logger.warning(f"Retrying LLM request (attempt {attempt + 2}) in {delay:.2f}s")
+            await asyncio.sleep(delay)
+    
+    def _token_estimate(self, prompt: str, params: Dict[str, Any]) -> int:
+        """TPM charge: estimated prompt tokens plus the completion reserve"""
+        return estimate_tokens(prompt) + params.get("max_tokens", self.max_tokens)
+    
+    async def stream(self, prompt: str, params: Dict[str, Any] = {}) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a completion as {"token": text} events, then one {"result": ...}.
+        
+        The result is what send returns plus generation_ms, ttft_ms (time to
+        the first token) and tokens_per_sec (completion tokens over the time
+        from the first token to the end). Cache hits, and providers without an
+        OpenAI-style stream, get the whole answer as a single token.
+        """
+        start = time.perf_counter()
+        first_token_at = None
+        params, key, cache = self._request_key(prompt, params)
+        cacheable = self._cacheable(params, cache)
+        result = await response_cache.aget(key) if cacheable else None
+        ok = False
+        
+        if result is not None or self.provider not in ["openrouter", "openai"]:
+            if result is None:
+                result, ok = await self._fetch(prompt, params)
+            first_token_at = time.perf_counter()
+            if result["answer_text"]:
+                yield {"token": result["answer_text"]}
+        else:
+            url, headers, payload, model = self._build_request(prompt, params)
+            payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+            limiter = get_limiter(self.provider, model)
+            tokens = self._token_estimate(prompt, params)
+            parts = []
+            usage = {}
             try:
-                error_json = e.response.json()
-                error_detail = error_json.get("error", {}).get("message", str(error_json))
-            except:
-                error_detail = e.response.text
-            
-            return {
-                "answer_text": f"OpenAI API Error {e.response.status_code}: {error_detail}",
-                "prompt_tokens": 0,
-                "completion_tokens": 0,
-                "total_tokens": 0,
-                "est_cost_usd": 0.0,
-                "confidence": None,
-                "llm_pred_label": None
-            }
-        except Exception as e:
-            logger.error(f"Unexpected error: {type(e).__name__}: {str(e)}", exc_info=True)
-            return {
-                "answer_text": f"Error: {type(e).__name__}: {str(e)}",
-                "prompt_tokens": 0,
-                "completion_tokens": 0,
-                "total_tokens": 0,
-                "est_cost_usd": 0.0,
-                "confidence": None,
-                "llm_pred_label": None
-            }
\ No newline at end of file
+                # Rejected streams (429/5xx) are retried; nothing has been relayed yet
+                for attempt in range(settings.LLM_MAX_RETRIES + 1):
+                    delay = None
+                    async with limiter.slot(tokens) as admission:
+                        logger.info("Sending streaming HTTP request...")
+                        async with get_async_http_client().stream(
+                            "POST", url, json=payload, headers=headers
+                        ) as response:
+                            if response.status_code != 200:
+                                await response.aread()
+                            if is_retryable(response.status_code) and attempt < settings.LLM_MAX_RETRIES:
+                                wait = retry_after(response)
+                                limiter.throttle(wait)
+                                delay = 0.0 if wait else backoff(attempt)
+                            else:
+                                response.raise_for_status()
+                                
+                                async for line in response.aiter_lines():
+                                    if not line.startswith("data:"):
+                                        continue
+                                    data = line[5:].strip()
+                                    if data == "[DONE]":
+                                        break
+                                    chunk = json.loads(data)
+                                    usage = chunk.get("usage") or usage
+                                    for choice in chunk.get("choices", []):
+                                        text = (choice.get("delta") or {}).get("content")
+                                        if text:
+                                            if first_token_at is None:
+                                                first_token_at = time.perf_counter()
+                                            parts.append(text)
+                                            yield {"token": text}
+                                
+                                result = self._parse_response(
+                                    {"choices": [{"message": {"content": "".join(parts)}}], "usage": usage},
+                                    prompt,
+                                    model
+                                )
+                                admission.succeeded(result["total_tokens"])
+                                ok = True
+                    if delay is None:
+                        break
+                    logger.warning(f"Retrying streaming LLM request (attempt {attempt + 2}) in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+            except httpx.HTTPStatusError as e:
+                if is_retryable(e.response.status_code):
+                    limiter.throttle(retry_after(e.response))
+                result = self._status_error(e)
+            except Exception as e:
+                result = self._unexpected_error(e)
+        
+        end = time.perf_counter()
+        if ok and cacheable:
+            await response_cache.aput(key, result, (end - start) * 1000)
+        decode_s = end - first_token_at if first_token_at is not None and not result.get("cache_hit") else 0.0
+        yield {"result": {
+            **result,
+            "generation_ms": (end - start) * 1000,
+            "ttft_ms": (first_token_at - start) * 1000 if first_token_at is not None else None,
+            "tokens_per_sec": result["completion_tokens"] / decode_s if decode_s > 0 else None
+        }}
\ No newline at end of file
@@ -0,0 +1,233 @@
+# agents/tools/rate_limiter.py
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+import httpx
+from core.config import settings
+
+# Concurrency is halved at most once per this many seconds, so one burst of
+# 429s counts as a single congestion signal
+DECREASE_COOLDOWN_S = 1.0
+
+# Longest a waiter sleeps before re-checking (waiters on other event loops are not notified)
+MAX_WAIT_S = 0.25
+
+
+class TokenBucket:
+    """Refills at rate_per_minute / 60 per second up to rate_per_minute"""
+
+    def __init__(self, rate_per_minute: int):
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.refill_per_s = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_s)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken (requests above capacity wait for a full bucket)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_s
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Admission:
+    """One admitted request; its reservation is refunded unless it succeeds"""
+
+    def __init__(self, limiter: "ProviderLimiter", tokens: float):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.settled = False
+
+    def succeeded(self, actual_tokens: Optional[int]):
+        self.settled = True
+        self.limiter.succeeded(self.tokens, actual_tokens)
+
+
+class ProviderLimiter:
+    """Admission control for one provider/model.
+
+    A request is admitted when the RPM and TPM buckets both have room, fewer
+    than `limit` requests are in flight and no Retry-After pause is active.
+    The concurrency limit follows AIMD: +1/limit per success (about +1 per
+    round of requests), halved on a 429 or 5xx. Attempts that fail (error
+    status, connection error, cancellation) get their RPM and TPM charge back.
+    """
+
+    def __init__(self, rpm: int, tpm: int, initial_concurrency: int, max_concurrency: int):
+        self.rpm = TokenBucket(rpm) if rpm > 0 else None
+        self.tpm = TokenBucket(tpm) if tpm > 0 else None
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(initial_concurrency, max_concurrency))
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.throttled = 0
+        self.waited_s = 0.0
+        self._lock = threading.Lock()
+        self._conditions: Dict[asyncio.AbstractEventLoop, asyncio.Condition] = {}
+
+    def _condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        condition = self._conditions.get(loop)
+        if condition is None:
+            condition = self._conditions[loop] = asyncio.Condition()
+        return condition
+
+    def _try_admit(self, tokens: float) -> Optional[float]:
+        """Admit and charge the request (None), or return how long to wait"""
+        with self._lock:
+            now = time.monotonic()
+            waits = [self.blocked_until - now]
+            if self.in_flight >= int(self.limit):
+                waits.append(MAX_WAIT_S)
+            if self.rpm:
+                waits.append(self.rpm.wait_time(1, now))
+            if self.tpm:
+                waits.append(self.tpm.wait_time(tokens, now))
+            wait = max(waits)
+            if wait > 0:
+                return wait
+            if self.rpm:
+                self.rpm.take(1)
+            if self.tpm:
+                self.tpm.take(tokens)
+            self.in_flight += 1
+            return None
+
+    @asynccontextmanager
+    async def slot(self, tokens: float) -> AsyncIterator[Admission]:
+        """Hold one admitted request for the duration of the block.
+
+        Call succeeded() on the yielded admission once the response is good;
+        otherwise the reservation is refunded when the block exits.
+        """
+        condition = self._condition()
+        start = time.monotonic()
+        async with condition:
+            while True:
+                wait = self._try_admit(tokens)
+                if wait is None:
+                    break
+                try:
+                    await asyncio.wait_for(condition.wait(), timeout=min(wait, MAX_WAIT_S))
+                except asyncio.TimeoutError:
+                    pass
+        with self._lock:
+            self.waited_s += time.monotonic() - start
+        admission = Admission(self, tokens)
+        try:
+            yield admission
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                if not admission.settled:
+                    self._refund(tokens)
+            async with condition:
+                condition.notify_all()
+
+    def succeeded(self, estimated_tokens: float, actual_tokens: Optional[int]):
+        with self._lock:
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            # Return the unused part of the completion reserve
+            if self.tpm and actual_tokens:
+                self.tpm.give_back(max(estimated_tokens - actual_tokens, 0))
+
+    def _refund(self, tokens: float):
+        """Give back the charge of an attempt that failed (caller holds the lock)"""
+        if self.rpm:
+            self.rpm.give_back(1)
+        if self.tpm:
+            self.tpm.give_back(min(tokens, self.tpm.capacity))
+
+    def throttle(self, retry_after: Optional[float]):
+        """Congestion signal (429/5xx): halve concurrency and honour Retry-After"""
+        with self._lock:
+            now = time.monotonic()
+            self.throttled += 1
+            if now - self.last_decrease >= DECREASE_COOLDOWN_S:
+                self.limit = max(1.0, self.limit / 2)
+                self.last_decrease = now
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "concurrency_limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "rpm_available": round(self.rpm.tokens, 1) if self.rpm else None,
+                "tpm_available": round(self.tpm.tokens, 1) if self.tpm else None,
+                "paused_s": max(self.blocked_until - time.monotonic(), 0.0),
+                "throttled": self.throttled,
+                "waited_s": round(self.waited_s, 3)
+            }
+
+
+_limiters: Dict[Tuple[str, str], ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str, model: str) -> ProviderLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get((provider, model))
+        if limiter is None:
+            limiter = _limiters[(provider, model)] = ProviderLimiter(
+                rpm=settings.LLM_RPM_LIMIT,
+                tpm=settings.LLM_TPM_LIMIT,
+                initial_concurrency=settings.LLM_CONCURRENCY_INITIAL,
+                max_concurrency=settings.LLM_CONCURRENCY_MAX
+            )
+        return limiter
+
+
+def is_retryable(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    """Seconds from Retry-After (delta or HTTP date) or retry-after-ms, if present"""
+    value = response.headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int) -> float:
+    """Jittered exponential backoff for retries without Retry-After"""
+    return settings.LLM_RETRY_BACKOFF_S * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def limiter_stats() -> Dict[str, Any]:
+    """Admission state of every provider/model limiter"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {f"{provider}/{model}": limiter.stats() for (provider, model), limiter in limiters.items()}
+# Per-provider rate and concurrency limits for LLM calls
\ No newline at end of file
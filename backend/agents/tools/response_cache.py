@@ -0,0 +1,192 @@
+# agents/tools/response_cache.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from core.config import settings
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(provider: str, model: str, sampling: Dict[str, Any], prompt: str) -> str:
+    """Content address of one completion request"""
+    body = json.dumps(
+        {"provider": provider, "model": model, "sampling": sampling, "prompt": prompt},
+        sort_keys=True
+    )
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+def should_cache(temperature: float, force: Optional[bool] = None) -> bool:
+    """Sampled (temperature > 0) completions are not reused unless forced.
+
+    force=True caches regardless of temperature, force=False never caches.
+    """
+    if not settings.LLM_CACHE_ENABLED or force is False:
+        return False
+    return bool(force) or temperature <= 0 or settings.LLM_CACHE_NONZERO_TEMPERATURE
+
+
+class ResponseCache:
+    """Two-tier completion cache: an in-memory LRU in front of a SQLite file.
+
+    Entries are (result, latency_ms, expires_at); expires_at is None when
+    ttl_s is 0. The disk tier survives restarts and is shared by workers
+    pointing at the same file. Coroutines use aget/aput, which only touch
+    SQLite from a worker thread.
+    """
+
+    def __init__(self, path: str, ttl_s: int, max_entries: int, max_bytes: int):
+        self.path = path
+        self.ttl_s = ttl_s
+        self._memory = LRUCache(
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            sizeof=lambda entry: len(entry[0].get("answer_text") or "") + 300
+        )
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+        self.saved_cost_usd = 0.0
+        self.saved_ms = 0.0
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, result TEXT, latency_ms REAL, "
+                "created_at REAL, expires_at REAL)"
+            )
+        return self._conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached result marked as a hit, with the cost and latency it saved"""
+        now = time.time()
+        entry = self._memory_get(key, now)
+        if entry is None:
+            entry = self._disk_get(key, now)
+            if entry is None:
+                return None
+            self._memory.put(key, entry)
+        return self._hit(entry)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """get for coroutines: the SQLite lookup runs in a worker thread"""
+        now = time.time()
+        entry = self._memory_get(key, now)
+        if entry is None:
+            entry = await asyncio.to_thread(self._disk_get, key, now)
+            if entry is None:
+                return None
+            self._memory.put(key, entry)
+        return self._hit(entry)
+
+    def put(self, key: str, result: Dict[str, Any], latency_ms: float):
+        entry = self._entry(result, latency_ms)
+        self._memory.put(key, entry)
+        self._disk_put(key, entry)
+
+    async def aput(self, key: str, result: Dict[str, Any], latency_ms: float):
+        """put for coroutines: the SQLite write runs in a worker thread"""
+        entry = self._entry(result, latency_ms)
+        self._memory.put(key, entry)
+        await asyncio.to_thread(self._disk_put, key, entry)
+
+    def _entry(self, result: Dict[str, Any], latency_ms: float) -> tuple:
+        expires_at = time.time() + self.ttl_s if self.ttl_s else None
+        return result, latency_ms, expires_at
+
+    def _memory_get(self, key: str, now: float) -> Optional[tuple]:
+        entry = self._memory.get(key)
+        if entry is not None and entry[2] is not None and entry[2] <= now:
+            self._memory.pop(key)
+            return None
+        return entry
+
+    def _hit(self, entry: tuple) -> Dict[str, Any]:
+        result, latency_ms, _ = entry
+        with self._lock:
+            self.saved_cost_usd += result.get("est_cost_usd") or 0.0
+            self.saved_ms += latency_ms
+        return {
+            **result,
+            "est_cost_usd": 0.0,
+            "cache_hit": True,
+            "saved_cost_usd": result.get("est_cost_usd") or 0.0,
+            "saved_ms": latency_ms
+        }
+
+    def _disk_put(self, key: str, entry: tuple):
+        result, latency_ms, expires_at = entry
+        try:
+            with self._lock:
+                db = self._db()
+                if db is not None:
+                    db.execute(
+                        "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                        (key, json.dumps(result), latency_ms, time.time(), expires_at)
+                    )
+        except sqlite3.Error as e:
+            logger.warning(f"LLM response cache write failed: {e}")
+
+    def _disk_get(self, key: str, now: float) -> Optional[tuple]:
+        try:
+            with self._lock:
+                db = self._db()
+                if db is None:
+                    return None
+                row = db.execute(
+                    "SELECT result, latency_ms, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[2] is not None and row[2] <= now:
+                    db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    return None
+                self.disk_hits += 1
+        except sqlite3.Error as e:
+            logger.warning(f"LLM response cache read failed: {e}")
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            disk_entries = None
+            try:
+                db = self._db()
+                if db is not None:
+                    disk_entries = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            except sqlite3.Error:
+                pass
+            return {
+                **self._memory.stats(),
+                "disk_entries": disk_entries,
+                "disk_hits": self.disk_hits,
+                "saved_cost_usd": self.saved_cost_usd,
+                "saved_ms": self.saved_ms
+            }
+
+
+response_cache = ResponseCache(
+    path=settings.LLM_CACHE_PATH,
+    ttl_s=settings.LLM_CACHE_TTL_S,
+    max_entries=settings.LLM_CACHE_ENTRIES,
+    max_bytes=settings.LLM_CACHE_MB * 1024 * 1024
+)
+
+
+def response_cache_stats():
+    """Hit/miss counters and savings of the LLM response cache"""
+    return response_cache.stats()
+# Content-addressed LLM response cache
\ No newline at end of file
@@ -0,0 +1,221 @@
+# agents/tools/retriever_bm25.py
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from sqlalchemy.orm import Session
+from typing import Dict, List, Optional
+from core.config import settings
+from models.graph import NodeText
+from utils.cache import LRUCache, TEXT_SCOPE, graph_version, register_invalidation_hook
+
+
+class BM25Index:
+    """Inverted index for a single graph: term -> postings of (doc, precomputed BM25 impact)"""
+
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        post_ptr: np.ndarray,
+        post_docs: np.ndarray,
+        post_scores: np.ndarray,
+        node_ids: np.ndarray
+    ):
+        self.vocabulary = vocabulary
+        # Postings of term t are post_docs[post_ptr[t]:post_ptr[t + 1]], sorted by doc
+        self.post_ptr = post_ptr
+        self.post_docs = post_docs
+        self.post_scores = post_scores
+        self.node_ids = node_ids
+        self.analyzer = CountVectorizer(stop_words='english').build_analyzer()
+
+        # Per-term score upper bound, used for MaxScore pruning
+        lengths = np.diff(post_ptr)
+        upper = np.zeros(len(lengths), dtype=np.float32)
+        non_empty = lengths > 0
+        if non_empty.any():
+            upper[non_empty] = np.maximum.reduceat(post_scores, post_ptr[:-1][non_empty])
+        self.upper_bounds = upper
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.post_ptr, self.post_docs, self.post_scores, self.node_ids]
+        return sum(a.nbytes for a in arrays) + 100 * len(self.vocabulary)
+
+    def postings(self, term_id: int):
+        start, end = self.post_ptr[term_id], self.post_ptr[term_id + 1]
+        return self.post_docs[start:end], self.post_scores[start:end]
+
+    def query_terms(self, query: str) -> Dict[int, int]:
+        """Query term ids with their in-query frequencies"""
+        term_counts: Dict[int, int] = {}
+        for token in self.analyzer(query):
+            term_id = self.vocabulary.get(token)
+            if term_id is not None:
+                term_counts[term_id] = term_counts.get(term_id, 0) + 1
+        return term_counts
+
+    def search(self, query: str, top_k: int) -> List[int]:
+        """Top-k doc indices for a query, touching only the query terms' postings.
+
+        Terms are visited in decreasing upper-bound order (term-at-a-time
+        MaxScore). Once the k-th best partial score reaches the sum of the
+        remaining terms' upper bounds, those terms can no longer lift an unseen
+        document into the top-k, so they only refine existing candidates, and
+        candidates that cannot reach the threshold are dropped.
+        """
+        term_counts = self.query_terms(query)
+        if not term_counts or top_k <= 0:
+            return []
+
+        terms = sorted(
+            term_counts,
+            key=lambda t: self.upper_bounds[t] * term_counts[t],
+            reverse=True
+        )
+        bounds = np.array([self.upper_bounds[t] * term_counts[t] for t in terms])
+        # remaining[i] = best possible contribution of terms[i:]
+        remaining = np.concatenate([np.cumsum(bounds[::-1])[::-1], [0.0]])
+
+        cand_docs = np.empty(0, dtype=self.post_docs.dtype)
+        cand_scores = np.empty(0, dtype=np.float32)
+
+        for i, term_id in enumerate(terms):
+            threshold = _kth_largest(cand_scores, top_k)
+            weight = term_counts[term_id]
+            docs, scores = self.postings(term_id)
+
+            if threshold is not None and threshold >= remaining[i]:
+                # Non-essential term: drop hopeless candidates, then score the rest
+                alive = cand_scores + remaining[i] >= threshold
+                cand_docs, cand_scores = cand_docs[alive], cand_scores[alive]
+                positions = np.searchsorted(docs, cand_docs)
+                positions[positions >= len(docs)] = 0
+                hit = docs[positions] == cand_docs if len(docs) else np.zeros(0, bool)
+                cand_scores = cand_scores.copy()
+                cand_scores[hit] += weight * scores[positions[hit]]
+                continue
+
+            # Essential term: merge its postings into the accumulators
+            merged_docs = np.concatenate([cand_docs, docs])
+            merged_scores = np.concatenate([cand_scores, weight * scores])
+            cand_docs, inverse = np.unique(merged_docs, return_inverse=True)
+            cand_scores = np.bincount(
+                inverse, weights=merged_scores, minlength=len(cand_docs)
+            ).astype(np.float32)
+
+        if len(cand_docs) == 0:
+            return []
+
+        k = min(top_k, len(cand_docs))
+        top = np.argpartition(-cand_scores, k - 1)[:k]
+        # Ties resolve by doc order so results are deterministic
+        top = top[np.lexsort((cand_docs[top], -cand_scores[top]))]
+        return cand_docs[top].tolist()
+
+
+def _kth_largest(values: np.ndarray, k: int) -> Optional[float]:
+    if len(values) < k:
+        return None
+    return float(np.partition(values, len(values) - k)[len(values) - k])
+
+
+def build_index(db: Session, graph_id: str) -> Optional[BM25Index]:
+    """Build the inverted index for all node texts of a graph"""
+    rows = db.query(NodeText.node_id, NodeText.text).filter(
+        NodeText.graph_id == graph_id
+    ).all()
+
+    if not rows:
+        return None
+
+    texts = [text or "" for _, text in rows]
+    node_ids = np.array([node_id for node_id, _ in rows], dtype=object)
+
+    counter = CountVectorizer(stop_words='english')
+    try:
+        doc_terms = counter.fit_transform(texts)
+    except ValueError:
+        # Empty vocabulary (e.g. only stop words)
+        return None
+
+    k1, b = settings.BM25_K1, settings.BM25_B
+    n_docs = doc_terms.shape[0]
+    doc_len = np.asarray(doc_terms.sum(axis=1)).ravel().astype(np.float64)
+    avgdl = doc_len.mean() if doc_len.mean() > 0 else 1.0
+
+    # Term-major layout: CSC columns are exactly the postings lists
+    postings = doc_terms.tocsc()
+    postings.sort_indices()
+    df = np.diff(postings.indptr)
+    idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+    # Precompute each posting's BM25 contribution (impact score)
+    tf = postings.data.astype(np.float64)
+    term_of_posting = np.repeat(np.arange(len(df)), df)
+    norm = k1 * (1 - b + b * doc_len[postings.indices] / avgdl)
+    impact = idf[term_of_posting] * tf * (k1 + 1) / (tf + norm)
+
+    vocabulary = {str(term): i for i, term in enumerate(counter.get_feature_names_out())}
+    return BM25Index(
+        vocabulary,
+        postings.indptr.astype(np.int64),
+        postings.indices.astype(np.int32),
+        impact.astype(np.float32),
+        node_ids
+    )
+
+
+# Shared by every BM25Retriever in the process, keyed by (graph_id, graph_version)
+_index_cache = LRUCache(
+    max_entries=settings.RETRIEVER_INDEX_CACHE_ENTRIES,
+    max_bytes=settings.RETRIEVER_INDEX_CACHE_MB * 1024 * 1024,
+    sizeof=lambda index: index.nbytes
+)
+register_invalidation_hook(
+    TEXT_SCOPE,
+    lambda graph_id, node_ids: _index_cache.discard_where(lambda key: key[0] == graph_id)
+)
+
+
+def get_index(db: Session, graph_id: str) -> Optional[BM25Index]:
+    key = (graph_id, graph_version(graph_id, TEXT_SCOPE))
+    return _index_cache.get_or_build(key, lambda: build_index(db, graph_id))
+
+
+class BM25Retriever:
+    """BM25 over an inverted index; cost scales with the query terms' postings, not graph size"""
+
+    def __init__(self):
+        self.index = None
+
+    def fit(self, db: Session, graph_id: str):
+        """Load (or build) the shared inverted index for a graph"""
+        self.index = get_index(db, graph_id)
+
+    def retrieve(
+        self,
+        db: Session,
+        graph_id: str,
+        query: str,
+        top_k: int = 5
+    ) -> List[str]:
+        """Retrieve top-k nodes by BM25 score"""
+        return self.retrieve_many(db, graph_id, [query], top_k)[0]
+
+    def retrieve_many(
+        self,
+        db: Session,
+        graph_id: str,
+        queries: List[str],
+        top_k: int = 5
+    ) -> List[List[str]]:
+        """Retrieve top-k nodes for each query"""
+        self.fit(db, graph_id)
+
+        if self.index is None:
+            return [[] for _ in queries]
+
+        return [
+            [str(self.index.node_ids[i]) for i in self.index.search(query, top_k)]
+            for query in queries
+        ]
+# BM25 inverted-index retriever
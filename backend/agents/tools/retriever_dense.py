@@ -0,0 +1,443 @@
+# agents/tools/retriever_dense.py
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import threading
+import numpy as np
+from sqlalchemy.orm import Session
+from typing import Any, Dict, List, Optional, Tuple
+from core.config import settings
+from db.database import SessionLocal
+from models.graph import NodeText
+from utils.cache import LRUCache, TEXT_SCOPE, graph_version, register_invalidation_hook
+from utils.io import current_version, ensure_dir, new_version_dir, publish_version, version_stamp
+from utils.jobs import FINISHED, Job, ProgressCallback, job_manager
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+# Present while the published index predates a node-text change; the rebuild
+# job claims it by deleting it (dot-entries are never pruned)
+STALE_NAME = ".stale"
+INDEX_TYPES = ("flat", "ivf", "hnsw")
+ENCODER_MISSING = "Dense retrieval needs sentence-transformers (pip install sentence-transformers)"
+HNSWLIB_MISSING = "DENSE_INDEX_TYPE=hnsw needs hnswlib (pip install hnswlib)"
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def check_available():
+    """Raise RuntimeError if the optional dependencies of dense retrieval are missing"""
+    if importlib.util.find_spec("sentence_transformers") is None:
+        raise RuntimeError(ENCODER_MISSING)
+    if settings.DENSE_INDEX_TYPE == "hnsw" and importlib.util.find_spec("hnswlib") is None:
+        raise RuntimeError(HNSWLIB_MISSING)
+
+
+def _get_encoder():
+    """Load the sentence-embedding model once per process (CPU)"""
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError as e:
+                raise RuntimeError(ENCODER_MISSING) from e
+            _encoder = SentenceTransformer(settings.DENSE_MODEL_NAME, device="cpu")
+        return _encoder
+
+
+def embed(texts: List[str]) -> np.ndarray:
+    """L2-normalised float32 embeddings, one row per text"""
+    vectors = _get_encoder().encode(
+        texts,
+        batch_size=settings.DENSE_BATCH_SIZE,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=False
+    )
+    return np.asarray(vectors, dtype=np.float32)
+
+
+class DenseIndex:
+    """float16 embedding matrix (memory-mapped) plus an ANN structure over it.
+
+    - flat: exact scan, for small graphs
+    - ivf:  k-means coarse quantiser; DENSE_IVF_NPROBE lists are scanned per query
+    - hnsw: hnswlib graph; DENSE_HNSW_EF_SEARCH trades recall for latency
+    """
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        node_ids: np.ndarray,
+        index_type: str,
+        centroids: Optional[np.ndarray] = None,
+        list_ptr: Optional[np.ndarray] = None,
+        list_ids: Optional[np.ndarray] = None,
+        hnsw=None,
+        stamp: Optional[Tuple[int, int]] = None
+    ):
+        self.vectors = vectors
+        self.node_ids = node_ids
+        self.index_type = index_type
+        # IVF: ids of list c are list_ids[list_ptr[c]:list_ptr[c + 1]]
+        self.centroids = centroids
+        self.list_ptr = list_ptr
+        self.list_ids = list_ids
+        self.hnsw = hnsw
+        # version_stamp of the on-disk index this was loaded from
+        self.stamp = stamp
+
+    @property
+    def nbytes(self) -> int:
+        # The embedding matrix is memory-mapped; count only private structures
+        arrays = [a for a in (self.centroids, self.list_ptr, self.list_ids) if a is not None]
+        hnsw_bytes = self.vectors.shape[0] * settings.DENSE_HNSW_M * 8 if self.hnsw else 0
+        return sum(a.nbytes for a in arrays) + hnsw_bytes + 50 * len(self.node_ids)
+
+    def search(self, query_vecs: np.ndarray, top_k: int) -> List[List[int]]:
+        if self.index_type == "hnsw":
+            self.hnsw.set_ef(max(settings.DENSE_HNSW_EF_SEARCH, top_k))
+            k = min(top_k, self.vectors.shape[0])
+            labels, _ = self.hnsw.knn_query(query_vecs, k=k)
+            return [row.tolist() for row in labels]
+
+        results = []
+        for query in query_vecs:
+            if self.index_type == "ivf":
+                nprobe = min(settings.DENSE_IVF_NPROBE, len(self.centroids))
+                lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+                candidates = np.concatenate([
+                    self.list_ids[self.list_ptr[c]:self.list_ptr[c + 1]] for c in lists
+                ])
+            else:
+                candidates = np.arange(self.vectors.shape[0])
+
+            if len(candidates) == 0:
+                results.append([])
+                continue
+
+            candidates = np.sort(candidates)
+            scores = self.vectors[candidates].astype(np.float32) @ query
+            k = min(top_k, len(candidates))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            results.append(candidates[top].tolist())
+        return results
+
+
+def index_path(graph_id: str) -> str:
+    return os.path.join(settings.RETRIEVER_INDEX_DIR, graph_id, "dense")
+
+
+def _build_ivf(vectors: np.ndarray):
+    from sklearn.cluster import MiniBatchKMeans
+
+    n = vectors.shape[0]
+    nlist = settings.DENSE_IVF_NLIST or int(np.sqrt(n))
+    nlist = max(1, min(nlist, n))
+
+    # Train the coarse quantiser on a sample; assign everything in chunks
+    rng = np.random.default_rng(0)
+    sample_size = min(n, max(nlist * 64, 10000))
+    sample = vectors[np.sort(rng.choice(n, sample_size, replace=False))].astype(np.float32)
+    kmeans = MiniBatchKMeans(n_clusters=nlist, random_state=0, n_init=3).fit(sample)
+    centroids = kmeans.cluster_centers_.astype(np.float32)
+    centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+
+    assignment = np.empty(n, dtype=np.int32)
+    for start in range(0, n, 65536):
+        chunk = vectors[start:start + 65536].astype(np.float32)
+        assignment[start:start + 65536] = np.argmax(chunk @ centroids.T, axis=1)
+
+    list_ids = np.argsort(assignment, kind="stable").astype(np.int32)
+    list_ptr = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+    return centroids, list_ptr.astype(np.int64), list_ids
+
+
+def _build_hnsw(vectors: np.ndarray):
+    try:
+        import hnswlib
+    except ImportError as e:
+        raise RuntimeError(HNSWLIB_MISSING) from e
+
+    hnsw = hnswlib.Index(space="ip", dim=vectors.shape[1])
+    hnsw.init_index(
+        max_elements=vectors.shape[0],
+        ef_construction=settings.DENSE_HNSW_EF_CONSTRUCTION,
+        M=settings.DENSE_HNSW_M
+    )
+    for start in range(0, vectors.shape[0], 65536):
+        chunk = vectors[start:start + 65536].astype(np.float32)
+        hnsw.add_items(chunk, np.arange(start, start + len(chunk)))
+    return hnsw
+
+
+def build_index(
+    db: Session,
+    graph_id: str,
+    path: str,
+    progress: Optional[ProgressCallback] = None
+) -> Optional[DenseIndex]:
+    """Embed all node texts of a graph into a float16 memmap under path and index them.
+
+    The build is published as a new version of path (see utils.io), so
+    workers building at the same time do not collide.
+    """
+    index_type = settings.DENSE_INDEX_TYPE
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown DENSE_INDEX_TYPE '{index_type}', expected one of {INDEX_TYPES}")
+
+    rows = db.query(NodeText.node_id, NodeText.text).filter(
+        NodeText.graph_id == graph_id
+    ).all()
+
+    if not rows:
+        return None
+
+    ensure_dir(path)
+    build_dir = new_version_dir(path)
+    try:
+        _write_index(build_dir, rows, index_type, progress)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    publish_version(path, build_dir)
+    return load_index(path)
+
+
+def _write_index(build_dir: str, rows, index_type: str, progress: Optional[ProgressCallback]):
+    # Embed in batches straight into the on-disk matrix to keep memory flat
+    batch = settings.DENSE_BATCH_SIZE * 16
+    vectors = None
+    for start in range(0, len(rows), batch):
+        if progress:
+            progress(0.9 * start / len(rows), f"embedding {start}/{len(rows)} texts")
+        chunk = embed([text or "" for _, text in rows[start:start + batch]])
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(
+                os.path.join(build_dir, "vectors.npy"),
+                mode="w+",
+                dtype=np.float16,
+                shape=(len(rows), chunk.shape[1])
+            )
+        vectors[start:start + len(chunk)] = chunk
+    vectors.flush()
+    np.save(
+        os.path.join(build_dir, "node_ids.npy"),
+        np.array([node_id for node_id, _ in rows], dtype=str)
+    )
+
+    if progress:
+        progress(0.9, f"building {index_type} index")
+    if index_type == "ivf":
+        centroids, list_ptr, list_ids = _build_ivf(vectors)
+        np.save(os.path.join(build_dir, "centroids.npy"), centroids)
+        np.save(os.path.join(build_dir, "list_ptr.npy"), list_ptr)
+        np.save(os.path.join(build_dir, "list_ids.npy"), list_ids)
+    elif index_type == "hnsw":
+        _build_hnsw(vectors).save_index(os.path.join(build_dir, "hnsw.bin"))
+    del vectors
+
+    with open(os.path.join(build_dir, MANIFEST_NAME), 'w') as f:
+        json.dump({
+            "model": settings.DENSE_MODEL_NAME,
+            "index_type": index_type,
+            "num_vectors": len(rows)
+        }, f)
+
+
+def load_index(path: str) -> Optional[DenseIndex]:
+    """Open the current persisted index; the embedding matrix is memory-mapped read-only"""
+    # A version superseded and pruned while we open it is retried once
+    for _ in range(2):
+        stamp = version_stamp(path)
+        version_dir = current_version(path)
+        if version_dir is None:
+            return None
+        try:
+            return _load_version(version_dir, stamp)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _load_version(version_dir: str, stamp: Optional[Tuple[int, int]]) -> Optional[DenseIndex]:
+    with open(os.path.join(version_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+
+    # Rebuild if the model or index type changed since the index was written
+    if (manifest["model"] != settings.DENSE_MODEL_NAME
+            or manifest["index_type"] != settings.DENSE_INDEX_TYPE):
+        return None
+
+    def load(name: str, mmap: bool = False) -> np.ndarray:
+        return np.load(os.path.join(version_dir, name), mmap_mode="r" if mmap else None)
+
+    vectors = load("vectors.npy", mmap=True)
+    index = DenseIndex(vectors, load("node_ids.npy", mmap=True), manifest["index_type"], stamp=stamp)
+
+    if index.index_type == "ivf":
+        index.centroids = load("centroids.npy")
+        index.list_ptr = load("list_ptr.npy")
+        index.list_ids = load("list_ids.npy", mmap=True)
+    elif index.index_type == "hnsw":
+        import hnswlib
+
+        index.hnsw = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        index.hnsw.load_index(os.path.join(version_dir, "hnsw.bin"), max_elements=vectors.shape[0])
+    return index
+
+
+# Shared by every DenseRetriever in the process, keyed by (graph_id, graph_version)
+_index_cache = LRUCache(
+    max_entries=settings.RETRIEVER_INDEX_CACHE_ENTRIES,
+    max_bytes=settings.RETRIEVER_INDEX_CACHE_MB * 1024 * 1024,
+    sizeof=lambda index: index.nbytes
+)
+
+
+# Rebuild job per graph, so repeated invalidations queue at most one
+_rebuilds: Dict[str, Job] = {}
+_rebuilds_lock = threading.Lock()
+
+
+def _mark_stale(path: str):
+    with open(os.path.join(path, STALE_NAME), 'w'):
+        pass
+
+
+def _is_stale(path: str) -> bool:
+    return os.path.exists(os.path.join(path, STALE_NAME))
+
+
+def _invalidate(graph_id: str, node_ids):
+    # Keep serving the persisted index until its rebuild is published, so
+    # queries never re-embed the graph themselves after an upload
+    _index_cache.discard_where(lambda key: key[0] == graph_id)
+    path = index_path(graph_id)
+    if current_version(path) is not None:
+        _mark_stale(path)
+        schedule_rebuild(graph_id)
+
+
+register_invalidation_hook(TEXT_SCOPE, _invalidate)
+
+
+def rebuild_stale(
+    db: Session,
+    graph_id: str,
+    progress: Optional[ProgressCallback] = None
+) -> Optional[DenseIndex]:
+    """Rebuild the persisted index if node texts changed since it was built.
+
+    Returns None if it is not stale, or another worker already claimed the
+    rebuild. Changes made while the rebuild runs mark it stale again.
+    """
+    path = index_path(graph_id)
+    try:
+        os.remove(os.path.join(path, STALE_NAME))
+    except FileNotFoundError:
+        return None
+    try:
+        return build_index(db, graph_id, path, progress)
+    except BaseException:
+        _mark_stale(path)
+        raise
+
+
+def schedule_rebuild(graph_id: str):
+    """Queue a background rebuild of a stale index unless one is already pending"""
+    with _rebuilds_lock:
+        job = _rebuilds.get(graph_id)
+        if job is not None and job.status not in FINISHED:
+            return
+
+        def work(progress: ProgressCallback) -> Dict[str, Any]:
+            # Jobs outlive the request, so each gets its own session
+            job_db = SessionLocal()
+            try:
+                index = rebuild_stale(job_db, graph_id, progress)
+            finally:
+                job_db.close()
+            return {
+                "graph_id": graph_id,
+                "num_vectors": int(index.vectors.shape[0]) if index is not None else 0
+            }
+
+        _rebuilds[graph_id] = job_manager.submit("dense_index", work)
+
+
+def get_index(
+    db: Session,
+    graph_id: str,
+    progress: Optional[ProgressCallback] = None
+) -> Optional[DenseIndex]:
+    """Return the cached index for a graph, loading or building it on first use.
+
+    Building embeds every node text, which can take minutes on large graphs;
+    run POST /pipeline/{run_id}/dense-index?background=true first so the
+    first query finds a persisted index instead of building it in-request.
+    After node texts change, the previous index is served until the queued
+    rebuild replaces it.
+    """
+    key = (graph_id, graph_version(graph_id, TEXT_SCOPE))
+    path = index_path(graph_id)
+    index = _index_cache.get(key)
+
+    # Another worker may have rebuilt or invalidated the persisted index
+    if index is not None and version_stamp(path) != index.stamp:
+        _index_cache.pop(key)
+        index = None
+
+    if index is None:
+        index = _index_cache.get_or_build(
+            key, lambda: load_index(path) or build_index(db, graph_id, path, progress)
+        )
+
+    # Covers stale indexes left by a restart or marked by another worker
+    if _is_stale(path):
+        schedule_rebuild(graph_id)
+    return index
+
+
+class DenseRetriever:
+    """Sentence-embedding retriever with an approximate nearest neighbour index"""
+
+    def __init__(self):
+        self.index = None
+
+    def fit(self, db: Session, graph_id: str):
+        """Load (or build) the shared dense index for a graph"""
+        self.index = get_index(db, graph_id)
+
+    def retrieve(
+        self,
+        db: Session,
+        graph_id: str,
+        query: str,
+        top_k: int = 5
+    ) -> List[str]:
+        """Retrieve top-k nodes by embedding similarity"""
+        return self.retrieve_many(db, graph_id, [query], top_k)[0]
+
+    def retrieve_many(
+        self,
+        db: Session,
+        graph_id: str,
+        queries: List[str],
+        top_k: int = 5
+    ) -> List[List[str]]:
+        """Retrieve top-k nodes for each query, embedding all queries in one batch"""
+        self.fit(db, graph_id)
+
+        if self.index is None or not queries:
+            return [[] for _ in queries]
+
+        hits = self.index.search(embed(queries), top_k)
+        return [[str(self.index.node_ids[i]) for i in row] for row in hits]
+# Dense embedding retriever with ANN search
@@ -1,36 +1,478 @@
 # agents/tools/retriever_tfidf.py
+import json
+import logging
+import mmap
+import os
+import shutil
+import threading
+import uuid
+from collections import Counter, defaultdict
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy.sparse import csr_matrix, vstack
+from sklearn.feature_extraction.text import CountVectorizer
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from core.config import settings
 from models.graph import NodeText
+from utils.cache import LRUCache, TEXT_SCOPE, graph_version, register_invalidation_hook
+from utils.io import current_version, ensure_dir, new_version_dir, publish_version, unpublish, version_stamp
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+INDEX_FORMAT = 3
+MAX_FEATURES = 1000
+# Above this share of changed documents a full refit is cheaper than patching
+INCREMENTAL_MAX_CHANGED_FRACTION = 0.5
+# Upper bound on (queries x documents) scores materialised at once
+SCORE_BLOCK_CELLS = 16_000_000
+
+
+def _new_vectorizer(vocabulary: Optional[Dict[str, int]] = None) -> CountVectorizer:
+    return CountVectorizer(
+        stop_words='english',
+        ngram_range=(1, 2),
+        vocabulary=vocabulary
+    )
+
+
+def _is_mapped(array: np.ndarray) -> bool:
+    """True if the array (or a view of it) is backed by a memory-mapped file"""
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+class TFIDFIndex:
+    """TF-IDF state for a single graph.
+
+    Raw term counts and document frequencies are kept instead of a fitted
+    TfidfVectorizer matrix, so documents can be added or replaced without
+    re-tokenising the corpus. Weighting matches TfidfVectorizer defaults
+    (smooth idf, l2-normalised rows).
+    """
+
+    def __init__(
+        self,
+        vectorizer: CountVectorizer,
+        counts: csr_matrix,
+        df: np.ndarray,
+        node_ids: np.ndarray,
+        baseline_oov_rate: float = 0.0,
+        added_tokens: int = 0,
+        added_oov_tokens: int = 0,
+        stamp: Optional[Tuple[int, int]] = None
+    ):
+        self.vectorizer = vectorizer
+        self.counts = counts
+        self.df = df
+        self.node_ids = node_ids
+        # Share of corpus tokens outside the vocabulary at the last full fit
+        self.baseline_oov_rate = baseline_oov_rate
+        # Tokens seen in incrementally added documents since the last full fit
+        self.added_tokens = added_tokens
+        self.added_oov_tokens = added_oov_tokens
+        # version_stamp of the on-disk index this was saved to / loaded from
+        self.stamp = stamp
+
+        n_docs = counts.shape[0]
+        self.idf = np.log((1 + n_docs) / (1 + df.astype(np.float64))) + 1
+        norms = np.sqrt(counts.power(2) @ (self.idf ** 2))
+        norms[norms == 0] = 1.0
+        self.norms = norms
+
+    @property
+    def vocab_drift(self) -> float:
+        """How much more out-of-vocabulary text new documents carry than the fitted corpus"""
+        if not self.added_tokens:
+            return 0.0
+        return self.added_oov_tokens / self.added_tokens - self.baseline_oov_rate
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate private memory footprint, used for cache eviction.
+
+        Memory-mapped arrays live in the shared OS page cache and are not counted.
+        """
+        arrays = [
+            self.counts.data, self.counts.indices, self.counts.indptr,
+            self.node_ids, self.df, self.idf, self.norms
+        ]
+        array_bytes = sum(a.nbytes for a in arrays if not _is_mapped(a))
+        vocab_bytes = 100 * len(self.vectorizer.vocabulary)
+        return array_bytes + vocab_bytes
+
+    def transform(self, queries: List[str]) -> csr_matrix:
+        """L2-normalised TF-IDF vectors for the queries"""
+        weights = csr_matrix(self.vectorizer.transform(queries).multiply(self.idf))
+        norms = np.sqrt(np.asarray(weights.power(2).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return csr_matrix(weights.multiply(1 / norms[:, None]))
+
+    def scores(self, query_vecs: csr_matrix) -> np.ndarray:
+        """Cosine similarity of each query row against every document"""
+        # Document rows are raw counts, so the idf weighting is applied on the query side
+        raw = (self.counts @ csr_matrix(query_vecs.multiply(self.idf)).T).toarray().T
+        return raw / self.norms
+
+
+# Shared by every TFIDFRetriever in the process, keyed by (graph_id, graph_version)
+_index_cache = LRUCache(
+    max_entries=settings.RETRIEVER_INDEX_CACHE_ENTRIES,
+    max_bytes=settings.RETRIEVER_INDEX_CACHE_MB * 1024 * 1024,
+    sizeof=lambda index: index.nbytes
+)
+# Superseded in-memory indexes and the node ids changed since, waiting to be patched
+_stale_indexes: Dict[str, TFIDFIndex] = {}
+_pending_node_ids: Dict[str, Set[str]] = defaultdict(set)
+_graph_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+
+
+def index_path(graph_id: str) -> str:
+    return os.path.join(settings.RETRIEVER_INDEX_DIR, graph_id, "tfidf")
+
+
+def _pending_dir(graph_id: str) -> str:
+    return index_path(graph_id) + ".pending"
+
+
+def save_index(index: TFIDFIndex, path: str):
+    """Write the index as plain .npy arrays so it can be memory-mapped on load.
+
+    Each save is a new version directory under path, published by atomically
+    replacing its CURRENT pointer, so concurrent readers never observe a
+    half-written index and concurrent savers never collide.
+    """
+    ensure_dir(path)
+    build_dir = new_version_dir(path)
+
+    counts = index.counts
+    terms = index.vectorizer.get_feature_names_out()
+    np.save(os.path.join(build_dir, "data.npy"), counts.data)
+    np.save(os.path.join(build_dir, "indices.npy"), counts.indices)
+    np.save(os.path.join(build_dir, "indptr.npy"), counts.indptr)
+    np.save(os.path.join(build_dir, "df.npy"), index.df)
+    np.save(os.path.join(build_dir, "terms.npy"), np.asarray(terms, dtype=str))
+    np.save(os.path.join(build_dir, "node_ids.npy"), np.asarray(index.node_ids, dtype=str))
+
+    with open(os.path.join(build_dir, MANIFEST_NAME), 'w') as f:
+        json.dump({
+            "format": INDEX_FORMAT,
+            "shape": list(counts.shape),
+            "nnz": int(counts.nnz),
+            "baseline_oov_rate": index.baseline_oov_rate,
+            "added_tokens": index.added_tokens,
+            "added_oov_tokens": index.added_oov_tokens
+        }, f)
+
+    publish_version(path, build_dir)
+    index.stamp = version_stamp(path)
+
+
+def load_index(path: str) -> Optional[TFIDFIndex]:
+    """Open the current persisted index; the large arrays are memory-mapped read-only"""
+    # A version superseded and pruned while we open it is retried once
+    for _ in range(2):
+        stamp = version_stamp(path)
+        version_dir = current_version(path)
+        if version_dir is None:
+            return None
+        try:
+            return _load_version(version_dir, stamp)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _load_version(version_dir: str, stamp: Optional[Tuple[int, int]]) -> Optional[TFIDFIndex]:
+    with open(os.path.join(version_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != INDEX_FORMAT:
+        return None
+
+    def load(name: str, mmap: bool = True) -> np.ndarray:
+        return np.load(os.path.join(version_dir, name), mmap_mode="r" if mmap else None)
+
+    counts = csr_matrix(
+        (load("data.npy"), load("indices.npy"), load("indptr.npy")),
+        shape=tuple(manifest["shape"]),
+        copy=False
+    )
+    terms = load("terms.npy", mmap=False)
+
+    return TFIDFIndex(
+        _new_vectorizer({str(term): i for i, term in enumerate(terms)}),
+        counts,
+        load("df.npy", mmap=False),
+        load("node_ids.npy"),
+        baseline_oov_rate=manifest["baseline_oov_rate"],
+        added_tokens=manifest["added_tokens"],
+        added_oov_tokens=manifest["added_oov_tokens"],
+        stamp=stamp
+    )
+
+
+def _add_pending(graph_id: str, node_ids: Set[str]):
+    """Record changed node ids as a new file, so concurrent writers never overwrite each other"""
+    directory = _pending_dir(graph_id)
+    ensure_dir(directory)
+    name = uuid.uuid4().hex
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(sorted(node_ids), f)
+    os.replace(tmp_path, os.path.join(directory, f"{name}.json"))
+
+
+def _read_pending(graph_id: str) -> Tuple[Set[str], List[str]]:
+    """Node ids recorded by any worker, and the files they were read from"""
+    directory = _pending_dir(graph_id)
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith(".json")]
+    except FileNotFoundError:
+        return set(), []
+
+    node_ids, paths = set(), []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as f:
+                node_ids.update(json.load(f))
+        except FileNotFoundError:
+            # Applied and removed by another worker meanwhile
+            continue
+        paths.append(path)
+    return node_ids, paths
+
+
+def _clear_pending(paths: List[str]):
+    """Remove only the pending files that were applied; later ones stay for the next load"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _has_pending(graph_id: str) -> bool:
+    try:
+        with os.scandir(_pending_dir(graph_id)) as entries:
+            return any(entry.name.endswith(".json") for entry in entries)
+    except FileNotFoundError:
+        return False
+
+
+def _invalidate(graph_id: str, node_ids: Optional[Set[str]]):
+    with _graph_locks[graph_id]:
+        superseded = _index_cache.pop_where(lambda key: key[0] == graph_id)
+
+        if node_ids is None:
+            _stale_indexes.pop(graph_id, None)
+            _pending_node_ids.pop(graph_id, None)
+            unpublish(index_path(graph_id))
+            shutil.rmtree(_pending_dir(graph_id), ignore_errors=True)
+            return
+
+        # Keep the newest index around so the next lookup can patch it
+        if superseded:
+            _stale_indexes[graph_id] = superseded[-1]
+        _pending_node_ids[graph_id] |= node_ids
+
+        # Record pending changes on disk too, for other workers and restarts
+        if settings.RETRIEVER_PERSIST_INDEX and version_stamp(index_path(graph_id)):
+            _add_pending(graph_id, node_ids)
+
+
+register_invalidation_hook(TEXT_SCOPE, _invalidate)
+
+
+def _count_terms(index: TFIDFIndex, texts: List[str]):
+    """Tokenise only the given texts: term counts plus total / out-of-vocabulary token totals"""
+    analyze = index.vectorizer.build_analyzer()
+    vocabulary = index.vectorizer.vocabulary
+    indptr, indices, data = [0], [], []
+    total_tokens = 0
+    oov_tokens = 0
+
+    for text in texts:
+        tokens = analyze(text)
+        term_counts = Counter(vocabulary[t] for t in tokens if t in vocabulary)
+        total_tokens += len(tokens)
+        oov_tokens += len(tokens) - sum(term_counts.values())
+        for column, count in sorted(term_counts.items()):
+            indices.append(column)
+            data.append(count)
+        indptr.append(len(indices))
+
+    counts = csr_matrix(
+        (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32), indptr),
+        shape=(len(texts), len(vocabulary))
+    )
+    return counts, total_tokens, oov_tokens
+
+
+def _fetch_texts(db: Session, graph_id: str, node_ids: Iterable[str], chunk_size: int = 10000):
+    node_ids = list(node_ids)
+    rows = []
+    for start in range(0, len(node_ids), chunk_size):
+        rows.extend(db.query(NodeText.node_id, NodeText.text).filter(
+            NodeText.graph_id == graph_id,
+            NodeText.node_id.in_(node_ids[start:start + chunk_size])
+        ).all())
+    return rows
+
+
+def build_index(db: Session, graph_id: str) -> Optional[TFIDFIndex]:
+    """Fit TF-IDF on all node texts for a graph"""
+    rows = db.query(NodeText.node_id, NodeText.text).filter(
+        NodeText.graph_id == graph_id
+    ).all()
+
+    if not rows:
+        return None
+
+    texts = [text or "" for _, text in rows]
+    node_ids = np.array([node_id for node_id, _ in rows], dtype=str)
+
+    # Count every term once, then keep the MAX_FEATURES most frequent ones; the
+    # discarded mass gives the baseline out-of-vocabulary rate for drift checks
+    counter = _new_vectorizer()
+    all_counts = counter.fit_transform(texts)
+    term_freqs = np.asarray(all_counts.sum(axis=0)).ravel()
+    keep = np.sort(np.argsort(-term_freqs, kind="stable")[:MAX_FEATURES])
+    terms = counter.get_feature_names_out()[keep]
+
+    counts = all_counts[:, keep].astype(np.float32).tocsr()
+    counts.sort_indices()
+    total_tokens = float(term_freqs.sum())
+    baseline_oov_rate = 1 - float(term_freqs[keep].sum()) / total_tokens if total_tokens else 0.0
+    del all_counts
+
+    return TFIDFIndex(
+        _new_vectorizer({str(term): i for i, term in enumerate(terms)}),
+        counts,
+        np.bincount(counts.indices, minlength=len(terms)).astype(np.int64),
+        node_ids,
+        baseline_oov_rate=baseline_oov_rate
+    )
+
+
+def update_index(
+    db: Session,
+    graph_id: str,
+    index: TFIDFIndex,
+    node_ids: Set[str]
+) -> Optional[TFIDFIndex]:
+    """Replace the documents of the given nodes with their current texts.
+
+    Only the changed texts are tokenised; document frequencies are adjusted by
+    subtracting the old rows and adding the new ones. Returns None when a full
+    refit is needed instead (too many changes or vocabulary drift).
+    """
+    n_docs = index.counts.shape[0]
+    if len(node_ids) > INCREMENTAL_MAX_CHANGED_FRACTION * max(n_docs, 1):
+        return None
+
+    keep = ~np.isin(index.node_ids, np.asarray(sorted(node_ids), dtype=str))
+    removed = index.counts[~keep]
+
+    rows = _fetch_texts(db, graph_id, node_ids)
+    new_counts, total_tokens, oov_tokens = _count_terms(index, [text or "" for _, text in rows])
+
+    vocab_size = len(index.df)
+    df = (
+        index.df
+        - np.bincount(removed.indices, minlength=vocab_size)
+        + np.bincount(new_counts.indices, minlength=vocab_size)
+    )
+
+    updated = TFIDFIndex(
+        index.vectorizer,
+        vstack([index.counts[keep], new_counts], format="csr"),
+        df,
+        np.concatenate([
+            np.asarray(index.node_ids[keep], dtype=str),
+            np.array([node_id for node_id, _ in rows], dtype=str)
+        ]),
+        baseline_oov_rate=index.baseline_oov_rate,
+        added_tokens=index.added_tokens + total_tokens,
+        added_oov_tokens=index.added_oov_tokens + oov_tokens
+    )
+
+    if updated.vocab_drift > settings.RETRIEVER_VOCAB_DRIFT_THRESHOLD:
+        logger.info(
+            f"TF-IDF vocabulary drift {updated.vocab_drift:.3f} for {graph_id}, refitting"
+        )
+        return None
+    return updated
+
+
+def _load_or_build(db: Session, graph_id: str) -> Optional[TFIDFIndex]:
+    with _graph_locks[graph_id]:
+        path = index_path(graph_id)
+        base = _stale_indexes.pop(graph_id, None)
+        pending = _pending_node_ids.pop(graph_id, set())
+        pending_paths: List[str] = []
+
+        if settings.RETRIEVER_PERSIST_INDEX:
+            on_disk, pending_paths = _read_pending(graph_id)
+            pending |= on_disk
+            if base is None:
+                base = load_index(path)
+
+        if base is not None and not pending:
+            return base
+
+        index = update_index(db, graph_id, base, pending) if base is not None else None
+        if index is None:
+            index = build_index(db, graph_id)
+
+        if settings.RETRIEVER_PERSIST_INDEX:
+            if index is not None:
+                save_index(index, path)
+                # Reopen so the arrays are served from the shared page cache
+                # (keeping our copy if a concurrent invalidation unpublished it)
+                index = load_index(path) or index
+            _clear_pending(pending_paths)
+        return index
+
+
+def get_index(db: Session, graph_id: str) -> Optional[TFIDFIndex]:
+    """Return the cached index for a graph, loading, patching or fitting it on first use"""
+    key = (graph_id, graph_version(graph_id, TEXT_SCOPE))
+    index = _index_cache.get(key)
+
+    # Another worker may have invalidated, patched or rebuilt the persisted index
+    if index is not None and index.stamp is not None:
+        changed_on_disk = version_stamp(index_path(graph_id)) != index.stamp
+        if changed_on_disk or _has_pending(graph_id):
+            _index_cache.pop(key)
+            index = None
+
+    if index is None:
+        index = _index_cache.get_or_build(key, lambda: _load_or_build(db, graph_id))
+    return index
+
 
 class TFIDFRetriever:
     def __init__(self):
         self.vectorizer = None
-        self.vectors = None
+        self.index = None
         self.node_ids = []
-    
+
     def fit(self, db: Session, graph_id: str):
-        """Fit TF-IDF on all node texts for a graph"""
-        node_texts = db.query(NodeText).filter(
-            NodeText.graph_id == graph_id
-        ).all()
-        
-        if not node_texts:
+        """Load (or fit) the shared TF-IDF index for a graph"""
+        self.index = get_index(db, graph_id)
+
+        if self.index is None:
+            self.vectorizer = None
+            self.node_ids = []
             return
-        
-        texts = [nt.text for nt in node_texts]
-        self.node_ids = [nt.node_id for nt in node_texts]
-        
-        self.vectorizer = TfidfVectorizer(
-            max_features=1000,
-            stop_words='english',
-            ngram_range=(1, 2)
-        )
-        self.vectors = self.vectorizer.fit_transform(texts)
-    
+
+        self.vectorizer = self.index.vectorizer
+        self.node_ids = self.index.node_ids
+
     def retrieve(
         self,
         db: Session,
@@ -39,22 +481,48 @@ class TFIDFRetriever:
         top_k: int = 5
     ) -> List[str]:
         """Retrieve top-k most similar nodes to query"""
-        
-        # Fit if not already fitted
-        if self.vectorizer is None or not self.node_ids:
-            self.fit(db, graph_id)
-        
-        if self.vectorizer is None:
-            return []
-        
-        # Transform query
-        query_vec = self.vectorizer.transform([query])
-        
-        # Calculate similarities
-        similarities = cosine_similarity(query_vec, self.vectors).flatten()
-        
-        # Get top-k indices
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
-        
-        # Return node IDs
-        return [self.node_ids[i] for i in top_indices]# sklearn TF-IDF retriever
+        return self.retrieve_many(db, graph_id, [query], top_k)[0]
+
+    def retrieve_many(
+        self,
+        db: Session,
+        graph_id: str,
+        queries: List[str],
+        top_k: int = 5
+    ) -> List[List[str]]:
+        """Retrieve top-k most similar nodes for each query in one pass"""
+
+        # Always resolve through the registry so stale or foreign-graph state is never used
+        self.fit(db, graph_id)
+
+        if self.index is None or not queries:
+            return [[] for _ in queries]
+
+        # Transform all queries at once
+        query_vecs = self.index.transform(queries)
+
+        n_docs = len(self.node_ids)
+        k = min(top_k, n_docs)
+        if k <= 0:
+            return [[] for _ in queries]
+
+        # Score in row blocks so the dense score matrix stays bounded
+        rows_per_block = max(1, SCORE_BLOCK_CELLS // max(n_docs, 1))
+        results = []
+        for start in range(0, len(queries), rows_per_block):
+            similarities = self.index.scores(query_vecs[start:start + rows_per_block])
+            results.extend(
+                [str(self.node_ids[i]) for i in row] for row in top_k_indices(similarities, k)
+            )
+        return results
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores per row, best first (partial selection, no full sort)"""
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+# sklearn TF-IDF retriever
@@ -1,8 +1,9 @@
 # agents/tools/unigraph_adapter.py
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from sqlalchemy.orm import Session
 import pypdf
 from pathlib import Path
+from utils.jobs import ProgressCallback
 
 class UniGraphAdapter:
     """Normalize multimodal inputs to text"""
@@ -41,16 +42,19 @@ class UniGraphAdapter:
         self,
         db: Session,
         graph_id: str,
-        artifacts: List[str]
+        artifacts: List[str],
+        progress: Optional[ProgressCallback] = None
     ) -> Dict[str, Any]:
         """Process all multimodal inputs for a graph"""
+        report = progress or (lambda fraction, message: None)
         results = {
             "pdfs_processed": 0,
             "images_processed": 0,
             "texts_updated": 0
         }
         
-        for artifact in artifacts:
+        for i, artifact in enumerate(artifacts):
+            report(i / len(artifacts), f"normalizing {Path(artifact).name}")
             if artifact.endswith('.pdf'):
                 text = self.normalize_pdf(artifact)
                 # Store in NodeText or Artifact
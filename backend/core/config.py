@@ -14,12 +14,85 @@ class Settings(BaseSettings):
     LLM_TEMPERATURE: float = 0.2
     LLM_TOP_P: float = 0.9
     LLM_MAX_TOKENS: int = 512
+    LLM_TIMEOUT: float = 60.0
+    
+    # Pooled LLM connections (HTTP/2 needs httpx[http2])
+    LLM_HTTP2: bool = True
+    LLM_MAX_CONNECTIONS: int = 200
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 50
+    LLM_KEEPALIVE_EXPIRY: float = 30.0
+    
+    # LLM response cache (memory LRU in front of a SQLite file; "" = memory only)
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_ENTRIES: int = 10000
+    LLM_CACHE_MB: int = 64
+    LLM_CACHE_PATH: str = "data/llm_cache.db"
+    LLM_CACHE_TTL_S: int = 7 * 24 * 3600  # 0 = never expires
+    LLM_CACHE_NONZERO_TEMPERATURE: bool = False  # also reuse sampled (temperature > 0) answers
+    LLM_COALESCE_REQUESTS: bool = True  # identical concurrent cacheable requests share one provider call
+    
+    # Per provider/model admission control (0 = no limit)
+    LLM_RPM_LIMIT: int = 0
+    LLM_TPM_LIMIT: int = 0  # charged with estimated prompt tokens + max_tokens
+    LLM_CONCURRENCY_INITIAL: int = 16  # AIMD start; halved on 429/5xx
+    LLM_CONCURRENCY_MAX: int = 128
+    LLM_MAX_RETRIES: int = 3  # 429/5xx/connection errors
+    LLM_RETRY_BACKOFF_S: float = 0.5  # without Retry-After: 0.5, 1, 2 s (jittered)
     LLM_ENDPOINT_BASE: str = "https://api.openrouter.ai/v1"
     
     # RAG defaults
     RETRIEVER_TOP_K: int = 5
     RETRIEVER_HOPS: int = 2
     PROMPT_TEMPLATE_ID: str = "default_rag"
+    RETRIEVER_BACKEND: str = "tfidf"  # tfidf | bm25 | dense | hybrid
+    HYBRID_RETRIEVERS: str = "tfidf,dense"
+    RRF_K: int = 60
+    RETRIEVER_POOL_WORKERS: int = 8
+    BM25_K1: float = 1.2
+    BM25_B: float = 0.75
+    
+    # Retrieval index cache (shared across requests, per process)
+    RETRIEVER_INDEX_CACHE_ENTRIES: int = 16
+    RETRIEVER_INDEX_CACHE_MB: int = 1024
+    RETRIEVER_PERSIST_INDEX: bool = True
+    RETRIEVER_INDEX_DIR: str = "data/indexes"
+    RETRIEVER_VOCAB_DRIFT_THRESHOLD: float = 0.1
+    
+    # In-memory graph structure cache (CSR adjacency)
+    GRAPH_CACHE_ENTRIES: int = 16
+    GRAPH_CACHE_MB: int = 2048
+    GNN_INCREMENTAL_MAX_EDGES: int = 10000  # beyond this, incremental runs recompute fully
+    
+    # GraphSOS subgraph expansion limits
+    GRAPHSOS_MAX_FANOUT: int = 50  # neighbours followed per node per hop
+    GRAPHSOS_HOP_NODE_BUDGET: int = 500  # new nodes admitted per hop
+    
+    # Context packing (optional: tiktoken for exact counts)
+    CONTEXT_MAX_TOKENS: int = 1024
+    GRAPHSOS_NODE_MAX_TOKENS: int = 64  # per-node text cap inside the context
+    TOKENIZER_ENCODING: str = "cl100k_base"
+    TOKEN_COUNT_CACHE_SIZE: int = 100000  # memoized node-text / context-line counts
+    CONTEXT_CACHE_ENTRIES: int = 4096  # memoized GraphSOS outputs
+    CONTEXT_CACHE_MB: int = 64
+    FRAGMENT_CACHE_ENTRIES: int = 500000  # rendered per-node context lines
+    FRAGMENT_CACHE_MB: int = 256
+    
+    # Dense retrieval (optional: sentence-transformers, hnswlib for hnsw)
+    DENSE_MODEL_NAME: str = "sentence-transformers/all-MiniLM-L6-v2"
+    DENSE_BATCH_SIZE: int = 64
+    DENSE_INDEX_TYPE: str = "ivf"  # flat | ivf | hnsw
+    DENSE_IVF_NLIST: int = 0  # 0 = sqrt(num_nodes)
+    DENSE_IVF_NPROBE: int = 8
+    DENSE_HNSW_M: int = 16
+    DENSE_HNSW_EF_CONSTRUCTION: int = 200
+    DENSE_HNSW_EF_SEARCH: int = 64
+    
+    # Graph upload ingestion
+    INGEST_CHUNK_ROWS: int = 50000  # rows per executemany INSERT
+    
+    # Background pipeline jobs (in-process thread pool)
+    JOB_WORKERS: int = 2
+    JOB_HISTORY: int = 200  # finished jobs kept for status queries
     
     # Security
     API_KEY_ENABLED: bool = False
@@ -1,12 +1,33 @@
 # db/init_db.py
+from sqlalchemy import inspect, text
 from sqlalchemy.orm import Session
-from db.database import SessionLocal
+from db.database import Base, SessionLocal, engine
 from models.llm import PromptTemplate, LLMConfig
 import logging
 
 logger = logging.getLogger(__name__)
 
+def add_missing_columns():
+    """Add model columns missing from tables created by an older version.
+    
+    create_all only creates missing tables; new columns are all nullable, so
+    an ALTER TABLE ... ADD COLUMN brings existing databases up to date.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                logger.info(f"Added column {table.name}.{column.name}")
+
 def init_db():
+    add_missing_columns()
     db = SessionLocal()
     try:
         # Check if already initialized
@@ -9,6 +9,8 @@ import os, reprlib
 from db.database import engine, Base
 from db.init_db import init_db
 from routers import health, runs, graphs, pipeline, query, results
+from agents.tools.llm_client import close_http_clients
+from utils.jobs import job_manager
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -35,6 +37,8 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown
     logger.info("Shutting down...")
+    job_manager.shutdown()
+    await close_http_clients()
 
 app = FastAPI(
     title=settings.APP_NAME,
@@ -17,4 +17,11 @@ class Status(str, Enum):
     CREATED = "CREATED"
     RUNNING = "RUNNING"
     DONE = "DONE"
-    FAILED = "FAILED"# TaskType, Stage, Status enums
+    FAILED = "FAILED"
+
+class JobStatus(str, Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+    CANCELLED = "CANCELLED"# TaskType, Stage, Status enums
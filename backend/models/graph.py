@@ -1,5 +1,5 @@
 # models/graph.py
-from sqlalchemy import Column, Integer, String, Text
+from sqlalchemy import Column, Float, Integer, String, Text
 from db.database import Base
 
 class Graph(Base):
@@ -33,4 +33,16 @@ class Edge(Base):
     graph_id = Column(String, index=True)
     src = Column(String)
     dst = Column(String)
-    relation = Column(String)
\ No newline at end of file
+    relation = Column(String)
+
+class NodeFeature(Base):
+    __tablename__ = "node_features"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    graph_id = Column(String, index=True)
+    node_id = Column(String, index=True)
+    degree = Column(Integer)
+    pagerank = Column(Float)
+    clustering = Column(Float)
+    core = Column(Integer)
+    eigenvector = Column(Float)
\ No newline at end of file
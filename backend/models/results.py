@@ -29,6 +29,12 @@ class GenerationLog(Base):
     llm_answer_text = Column(Text)
     llm_pred_label = Column(String)
     confidence = Column(Float)
+    ttft_ms = Column(Float)  # streamed generations only
+    tokens_per_sec = Column(Float)
+    cache_hit = Column(Boolean)
+    coalesced = Column(Boolean)  # shared an identical in-flight request's provider call
+    saved_cost_usd = Column(Float)  # provider cost and latency a cache hit avoided
+    saved_ms = Column(Float)
 
 class Metrics(Base):
     __tablename__ = "metrics"
@@ -1,19 +1,35 @@
 # routers/graphs.py
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from typing import Optional, List
+from typing import Optional, List, Tuple
+import logging
 import pandas as pd
 import os
 
 from core.dependencies import get_db
 from core.security import get_api_key
+from db.database import SessionLocal
 from models.graph import Graph, Node, Edge, NodeText
 from schemas.graph import GraphCreate, GraphResponse, UploadResponse
-from utils.ids import generate_graph_id
-from utils.io import save_upload, load_csv
+from utils.cache import STRUCTURE_SCOPE, TEXT_SCOPE, invalidate_graph
+from utils.ids import generate_graph_id, generate_upload_id
+from utils.ingest import detect_format, edge_columns, ingest_file, node_columns, text_columns
+from utils.io import save_upload_stream
+from utils.jobs import ProgressCallback, job_manager
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Upload kind -> (table model, column mapper)
+INGEST_TARGETS = {
+    "edges": (Edge, edge_columns),
+    "nodes": (Node, node_columns),
+    "node_text": (NodeText, text_columns)
+}
+
 @router.post("", response_model=GraphResponse)
 def create_graph(
     graph_data: GraphCreate,
@@ -45,79 +61,125 @@ async def upload_graph_data(
     edges_file: Optional[UploadFile] = File(None),
     nodes_file: Optional[UploadFile] = File(None),
     node_text_file: Optional[UploadFile] = File(None),
+    background: bool = False,
     db: Session = Depends(get_db),
     api_key: Optional[str] = Depends(get_api_key)
 ):
-    """Upload graph data files"""
+    """Upload graph data files.
+    
+    background=true returns 202 with a job id once the files are on disk;
+    the rows are then inserted by a job whose progress (rows done / total)
+    is polled at /pipeline/jobs/{job_id}, and whose result is the upload
+    summary.
+    """
     
     # Check graph exists
     graph = db.query(Graph).filter(Graph.graph_id == graph_id).first()
     if not graph:
         raise HTTPException(status_code=404, detail="Graph not found")
     
-    artifacts = []
-    nodes_count = 0
-    edges_count = 0
-    texts_count = 0
-    
-    # Process edges
-    if edges_file:
-        filepath = f"data/uploads/{graph_id}_edges.csv"
-        content = await edges_file.read()
-        save_upload(content, filepath)
-        artifacts.append(filepath)
-        
-        df = load_csv(filepath)
-        for _, row in df.iterrows():
-            edge = Edge(
-                graph_id=graph_id,
-                src=str(row.get('src', row.get('source', row[0]))),
-                dst=str(row.get('dst', row.get('target', row[1]))),
-                relation=str(row.get('relation', row.get('type', 'connects')))
-            )
-            db.add(edge)
-            edges_count += 1
-    
-    # Process nodes
-    if nodes_file:
-        filepath = f"data/uploads/{graph_id}_nodes.csv"
-        content = await nodes_file.read()
-        save_upload(content, filepath)
-        artifacts.append(filepath)
-        
-        df = load_csv(filepath)
-        for _, row in df.iterrows():
-            node = Node(
-                graph_id=graph_id,
-                node_id=str(row.get('node_id', row.get('id', row[0]))),
-                label=str(row.get('label', row.get('type', 'node')))
-            )
-            db.add(node)
-            nodes_count += 1
-    
-    # Process node texts
-    if node_text_file:
-        filepath = f"data/uploads/{graph_id}_node_text.csv"
-        content = await node_text_file.read()
-        save_upload(content, filepath)
-        artifacts.append(filepath)
-        
-        df = load_csv(filepath)
-        for _, row in df.iterrows():
-            node_text = NodeText(
-                graph_id=graph_id,
-                node_id=str(row.get('node_id', row.get('id', row[0]))),
-                text=str(row.get('text', row.get('content', row[1] if len(row) > 1 else '')))
-            )
-            db.add(node_text)
-            texts_count += 1
+    # Files are streamed to disk, then parsed and inserted chunk by chunk
+    # (off the event loop), so memory stays flat for multi-GB edge lists.
+    # CSV, Parquet and Arrow IPC are accepted.
+    upload_id = generate_upload_id()
+    uploads = []
+    for upload, kind in ((edges_file, "edges"), (nodes_file, "nodes"), (node_text_file, "node_text")):
+        if upload:
+            filepath, file_format = await _save_upload(graph_id, upload_id, upload, kind)
+            uploads.append((kind, filepath, file_format))
+    
+    if not background:
+        try:
+            return await run_in_threadpool(_ingest_uploads, db, graph_id, uploads)
+        except RuntimeError as e:
+            db.rollback()
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    def work(progress: ProgressCallback):
+        # Jobs outlive the request, so each gets its own session
+        job_db = SessionLocal()
+        try:
+            return _ingest_uploads(job_db, graph_id, uploads, progress).model_dump()
+        finally:
+            job_db.close()
+    
+    job = job_manager.submit("upload", work)
+    return JSONResponse(status_code=202, content={
+        "status": "queued",
+        "stage": "upload",
+        "job_id": job.job_id
+    })
+
+async def _save_upload(graph_id: str, upload_id: str, upload: UploadFile, kind: str):
+    """Stream one uploaded file to disk; returns (filepath, file_format)"""
+    file_format = detect_format(upload.filename, await upload.read(8))
+    await upload.seek(0)
+    
+    # Named per upload: a queued job must not read a file a later upload rewrote
+    filepath = f"data/uploads/{graph_id}_{upload_id}_{kind}.{file_format}"
+    await save_upload_stream(upload, filepath)
+    return filepath, file_format
+
+def _ingest_uploads(
+    db: Session,
+    graph_id: str,
+    uploads: List[Tuple[str, str, str]],
+    progress: Optional[ProgressCallback] = None
+) -> UploadResponse:
+    """Insert saved upload files (kind, filepath, file_format) in one transaction"""
+    counts = {"edges": 0, "nodes": 0, "node_text": 0}
+    text_node_ids = set()
     
+    for position, (kind, filepath, file_format) in enumerate(uploads):
+        model, columns = INGEST_TARGETS[kind]
+        on_chunk = None
+        if kind == "node_text":
+            on_chunk = lambda chunk: text_node_ids.update(chunk["node_id"].tolist())
+        counts[kind] = ingest_file(
+            db, model, graph_id, filepath, columns,
+            file_format=file_format,
+            progress=_ingest_progress(graph_id, kind, position, len(uploads), progress),
+            on_chunk=on_chunk
+        )
+    
+    # All files land in a single transaction
     db.commit()
     
+    kinds = {kind for kind, _, _ in uploads}
+    if kinds & {"edges", "nodes"}:
+        invalidate_graph(graph_id, scopes=(STRUCTURE_SCOPE,))
+    if "node_text" in kinds:
+        # Only the uploaded nodes changed, so text indexes can be patched in place
+        invalidate_graph(graph_id, scopes=(TEXT_SCOPE,), node_ids=text_node_ids)
+    
     return UploadResponse(
         graph_id=graph_id,
-        nodes_count=nodes_count,
-        edges_count=edges_count,
-        texts_count=texts_count,
-        artifacts=artifacts
-    )# Graphs router
+        nodes_count=counts["nodes"],
+        edges_count=counts["edges"],
+        texts_count=counts["node_text"],
+        artifacts=[filepath for _, filepath, _ in uploads]
+    )
+
+def _ingest_progress(
+    graph_id: str,
+    kind: str,
+    position: int,
+    num_files: int,
+    job_progress: Optional[ProgressCallback] = None
+):
+    """Progress callback for ingest_file: logs every 10% of the file and, for
+    background uploads, reports to the job (each file is an equal share)"""
+    state = {"logged": -1}
+    
+    def report(rows: int, done: int, total: int):
+        fraction = done / total if total else 1.0
+        percent = int(100 * fraction)
+        if percent // 10 > state["logged"]:
+            state["logged"] = percent // 10
+            logger.info(f"Upload {graph_id} {kind}: {rows} rows, {percent}%")
+        if job_progress:
+            job_progress((position + fraction) / num_files, f"{kind}: {rows} rows, {percent}%")
+    
+    return report
+
+# Graphs router
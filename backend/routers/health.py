@@ -1,8 +1,26 @@
 # routers/health.py
 from fastapi import APIRouter
+from agents.tools.fragment_store import fragment_cache_stats
+from agents.tools.graph_sos import context_cache_stats
+from agents.tools.graph_store import adjacency_cache_stats
+from agents.tools.llm_client import inflight_stats
+from agents.tools.rate_limiter import limiter_stats
+from agents.tools.response_cache import response_cache_stats
 
 router = APIRouter()
 
 @router.get("")
 def health_check():
-    return {"status": "ok"}# Health check router
+    return {"status": "ok"}
+
+@router.get("/caches")
+def cache_stats():
+    """Counters of the in-process caches and LLM admission control"""
+    return {
+        "graph_context": context_cache_stats(),
+        "node_fragments": fragment_cache_stats(),
+        "graph_adjacency": adjacency_cache_stats(),
+        "llm_responses": response_cache_stats(),
+        "llm_inflight": inflight_stats(),
+        "llm_limits": limiter_stats()
+    }# Health check router
\ No newline at end of file
@@ -1,35 +1,69 @@
 # Pipeline router: unigraph/gnn/translator/rag
 # routers/pipeline.py
-from fastapi import APIRouter, Depends, HTTPException
+from functools import partial
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, List
 
 from core.dependencies import get_db
 from core.security import get_api_key
+from db.database import SessionLocal
 from models.run import Run
 from models.enums import Status
+from schemas.run import JobResponse
 from agents.tools.unigraph_adapter import UniGraphAdapter
 from agents.tools.gnn_adapter import GNNAdapter
 from agents.tools.graph_translator import GraphTranslator
+from agents.tools import retriever_dense
 from agents.agent_manager import AgentManager
+from utils.jobs import ProgressCallback, job_manager
 
 router = APIRouter()
 
-@router.post("/{run_id}/unigraph")
-def run_unigraph(
-    run_id: str,
-    db: Session = Depends(get_db),
-    api_key: Optional[str] = Depends(get_api_key)
-) -> Dict[str, Any]:
-    """Run UniGraph normalization"""
+# stage(db, run_id, graph_id, progress) -> result
+Stage = Callable[[Session, str, str, Optional[ProgressCallback]], Dict[str, Any]]
+
+def _get_run(db: Session, run_id: str) -> Run:
     run = db.query(Run).filter(Run.run_id == run_id).first()
     if not run:
         raise HTTPException(status_code=404, detail="Run not found")
+    return run
+
+def _dispatch(
+    db: Session,
+    run: Run,
+    name: str,
+    stage: Stage,
+    background: bool,
+    response: Response
+) -> Dict[str, Any]:
+    """Run a stage in the request, or queue it as a job and return the job id"""
+    if not background:
+        return stage(db, run.run_id, run.graph_id, None)
+    
+    run_id, graph_id = run.run_id, run.graph_id
     
+    def work(progress: ProgressCallback) -> Dict[str, Any]:
+        # Jobs outlive the request, so each gets its own session
+        job_db = SessionLocal()
+        try:
+            return stage(job_db, run_id, graph_id, progress)
+        finally:
+            job_db.close()
+    
+    job = job_manager.submit(name, work, run_id=run_id)
+    response.status_code = 202
+    return {
+        "status": "queued",
+        "stage": name,
+        "job_id": job.job_id
+    }
+
+def _unigraph(db: Session, run_id: str, graph_id: str, progress: Optional[ProgressCallback]) -> Dict[str, Any]:
     adapter = UniGraphAdapter()
-    results = adapter.process_graph(db, run.graph_id, [])
+    results = adapter.process_graph(db, graph_id, [], progress=progress)
     
-    run.status = Status.RUNNING
+    db.query(Run).filter(Run.run_id == run_id).update({"status": Status.RUNNING})
     db.commit()
     
     return {
@@ -38,19 +72,29 @@ def run_unigraph(
         **results
     }
 
-@router.post("/{run_id}/gnn-adapter")
-def run_gnn_adapter(
+@router.post("/{run_id}/unigraph")
+def run_unigraph(
     run_id: str,
+    response: Response,
+    background: bool = False,
     db: Session = Depends(get_db),
     api_key: Optional[str] = Depends(get_api_key)
 ) -> Dict[str, Any]:
-    """Run GNN adapter"""
-    run = db.query(Run).filter(Run.run_id == run_id).first()
-    if not run:
-        raise HTTPException(status_code=404, detail="Run not found")
-    
+    """Run UniGraph normalization (background=true queues it as a job)"""
+    run = _get_run(db, run_id)
+    return _dispatch(db, run, "unigraph", _unigraph, background, response)
+
+def _gnn_adapter(
+    db: Session,
+    run_id: str,
+    graph_id: str,
+    progress: Optional[ProgressCallback],
+    incremental: bool = False
+) -> Dict[str, Any]:
     adapter = GNNAdapter()
-    results = adapter.compute_features(db, run.graph_id, run_id)
+    results = adapter.compute_features(
+        db, graph_id, run_id, incremental=incremental, progress=progress
+    )
     
     return {
         "status": "completed",
@@ -58,19 +102,24 @@ def run_gnn_adapter(
         **results
     }
 
-@router.post("/{run_id}/translator")
-def run_translator(
+@router.post("/{run_id}/gnn-adapter")
+def run_gnn_adapter(
     run_id: str,
+    response: Response,
+    incremental: bool = False,
+    background: bool = False,
     db: Session = Depends(get_db),
     api_key: Optional[str] = Depends(get_api_key)
 ) -> Dict[str, Any]:
-    """Run GraphTranslator"""
-    run = db.query(Run).filter(Run.run_id == run_id).first()
-    if not run:
-        raise HTTPException(status_code=404, detail="Run not found")
-    
+    """Run GNN adapter (incremental=true applies only edges added since the last run;
+    background=true queues it as a job)"""
+    run = _get_run(db, run_id)
+    stage = partial(_gnn_adapter, incremental=incremental)
+    return _dispatch(db, run, "gnn_adapter", stage, background, response)
+
+def _translator(db: Session, run_id: str, graph_id: str, progress: Optional[ProgressCallback]) -> Dict[str, Any]:
     translator = GraphTranslator()
-    results = translator.create_alignment(db, run.graph_id, run_id)
+    results = translator.create_alignment(db, graph_id, run_id, progress=progress)
     
     return {
         "status": "completed",
@@ -78,30 +127,112 @@ def run_translator(
         **results
     }
 
+@router.post("/{run_id}/translator")
+def run_translator(
+    run_id: str,
+    response: Response,
+    background: bool = False,
+    db: Session = Depends(get_db),
+    api_key: Optional[str] = Depends(get_api_key)
+) -> Dict[str, Any]:
+    """Run GraphTranslator (background=true queues it as a job)"""
+    run = _get_run(db, run_id)
+    return _dispatch(db, run, "translator", _translator, background, response)
+
+def _dense_index(db: Session, run_id: str, graph_id: str, progress: Optional[ProgressCallback]) -> Dict[str, Any]:
+    try:
+        index = (
+            retriever_dense.rebuild_stale(db, graph_id, progress=progress)
+            or retriever_dense.get_index(db, graph_id, progress=progress)
+        )
+    except (RuntimeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "status": "completed",
+        "stage": "dense_index",
+        "num_vectors": int(index.vectors.shape[0]) if index is not None else 0,
+        "index_type": index.index_type if index is not None else None
+    }
+
+@router.post("/{run_id}/dense-index")
+def run_dense_index(
+    run_id: str,
+    response: Response,
+    background: bool = False,
+    db: Session = Depends(get_db),
+    api_key: Optional[str] = Depends(get_api_key)
+) -> Dict[str, Any]:
+    """Build (or load) the dense retrieval index ahead of the first dense query,
+    or rebuild it after node texts changed (background=true queues it as a job)"""
+    run = _get_run(db, run_id)
+    try:
+        retriever_dense.check_available()
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _dispatch(db, run, "dense_index", _dense_index, background, response)
+
+@router.get("/jobs", response_model=List[JobResponse])
+def list_jobs(
+    run_id: Optional[str] = None,
+    api_key: Optional[str] = Depends(get_api_key)
+):
+    """Recent background jobs, optionally for one run"""
+    return [job.to_dict() for job in job_manager.list(run_id)]
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+def get_job(
+    job_id: str,
+    api_key: Optional[str] = Depends(get_api_key)
+):
+    """Status, progress and result of a background job"""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@router.delete("/jobs/{job_id}", response_model=JobResponse)
+def cancel_job(
+    job_id: str,
+    api_key: Optional[str] = Depends(get_api_key)
+):
+    """Cancel a job: queued jobs never start, running ones stop at their next checkpoint"""
+    job = job_manager.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
 @router.post("/{run_id}/rag/prepare")
 def prepare_rag(
     run_id: str,
     top_k: int = 5,
     hops: int = 2,
+    max_context_tokens: Optional[int] = None,
     prompt_template_id: str = "default_rag",
+    retriever: Optional[str] = None,
     db: Session = Depends(get_db),
     api_key: Optional[str] = Depends(get_api_key)
 ) -> Dict[str, Any]:
     """Prepare RAG context"""
-    run = db.query(Run).filter(Run.run_id == run_id).first()
-    if not run:
-        raise HTTPException(status_code=404, detail="Run not found")
+    run = _get_run(db, run_id)
     
-    manager = AgentManager(db)
+    try:
+        manager = AgentManager(db, retriever=retriever)
+    except (RuntimeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Sample query for preview
     sample_query = "What is this graph about?"
-    results = manager.prepare_rag_context(
-        graph_id=run.graph_id,
-        query_text=sample_query,
-        top_k=top_k,
-        hops=hops
-    )
+    try:
+        results = manager.prepare_rag_context(
+            graph_id=run.graph_id,
+            query_text=sample_query,
+            top_k=top_k,
+            hops=hops,
+            max_context_tokens=max_context_tokens
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     return {
         "status": "ready",
@@ -110,5 +241,6 @@ def prepare_rag(
         "tokens_in_context": results["tokens_in_context"],
         "top_k": top_k,
         "hops": hops,
+        "retriever": manager.retriever_name,
         "prompt_template_id": prompt_template_id
     }
\ No newline at end of file
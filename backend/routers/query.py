@@ -1,90 +1,249 @@
 # Query router: ask LLM
 # routers/query.py
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Any, Callable, Dict, Optional
+import asyncio
 import json
 from datetime import datetime
 
 from core.dependencies import get_db
 from core.security import get_api_key
+from db.database import SessionLocal
 from models.run import Run, Query as QueryModel
 from models.results import RetrievalLog, GenerationLog
-from schemas.llm import QueryRequest, QueryResponse
+from schemas.llm import QueryRequest, QueryResponse, BatchQueryRequest, BatchQueryResponse
 from agents.agent_manager import AgentManager
 from utils.ids import generate_query_id
 
 router = APIRouter()
 
 @router.post("/{run_id}", response_model=QueryResponse)
-def query_llm(
+async def query_llm(
     run_id: str,
     request: QueryRequest,
     db: Session = Depends(get_db),
     api_key: Optional[str] = Depends(get_api_key)
 ):
-    """Query the LLM with graph context"""
+    """Query the LLM with graph context.
+    
+    Retrieval and every DB call run in the threadpool; the generation is
+    awaited on the shared connection pool, so a pending completion does not
+    hold a worker thread and the event loop never waits on SQLite.
+    """
     
     # Get run
-    run = db.query(Run).filter(Run.run_id == run_id).first()
-    if not run:
-        raise HTTPException(status_code=404, detail="Run not found")
+    run = await run_in_threadpool(_get_run, db, run_id)
     
-    # Generate query ID
-    query_id = generate_query_id()
+    manager = _get_manager(db, request.retriever)
+    rag_results = await _retrieve(
+        manager.prepare_rag_context,
+        graph_id=run.graph_id,
+        query_text=request.query_text,
+        top_k=request.top_k,
+        hops=request.hops,
+        max_context_tokens=request.max_context_tokens
+    )
     
-    # Save query
-    query = QueryModel(
-        run_id=run_id,
-        query_id=query_id,
-        query_text=request.query_text
+    prompt = await run_in_threadpool(manager.build_prompt, request.query_text, rag_results["context"])
+    
+    response = await _answer_query(
+        db, manager, run, request.query_text, request.top_k, request.hops, rag_results, prompt,
+        llm_config=_llm_config(request.cache)
     )
-    db.add(query)
+    if response.error:
+        raise HTTPException(status_code=response.status_code, detail=response.error)
+    await run_in_threadpool(db.commit)
+    
+    return response
+
+@router.post("/{run_id}/batch", response_model=BatchQueryResponse)
+async def query_llm_batch(
+    run_id: str,
+    request: BatchQueryRequest,
+    db: Session = Depends(get_db),
+    api_key: Optional[str] = Depends(get_api_key)
+):
+    """Query the LLM for many questions, retrieving context for all of them in one pass.
     
-    # Prepare RAG context
-    manager = AgentManager(db)
-    rag_results = manager.prepare_rag_context(
+    The generations are awaited concurrently. A failed generation does not
+    fail the batch: its item carries error and status_code (429 or 503) and
+    is not logged, while the answers that succeeded are logged and returned.
+    """
+    
+    # Get run
+    run = await run_in_threadpool(_get_run, db, run_id)
+    
+    manager = _get_manager(db, request.retriever)
+    rag_batch = await _retrieve(
+        manager.prepare_rag_contexts,
         graph_id=run.graph_id,
-        query_text=request.query_text,
+        query_texts=request.queries,
         top_k=request.top_k,
-        hops=request.hops
+        hops=request.hops,
+        max_context_tokens=request.max_context_tokens
     )
     
-    # Save retrieval log
-    retrieval_log = RetrievalLog(
-        run_id=run_id,
-        query_id=query_id,
-        k=request.top_k,
-        hops=request.hops,
-        prompt_template_id="default_rag",
-        tokens_in_context=rag_results["tokens_in_context"],
-        context_preview=rag_results["context"][:500]
+    prompts = await run_in_threadpool(
+        manager.build_prompts,
+        request.queries,
+        [rag_results["context"] for rag_results in rag_batch]
     )
-    db.add(retrieval_log)
     
-    # Generate response
-    gen_results = manager.generate_response(
+    # Wait for every generation before anything propagates, so none is still
+    # staging logs on the session once the request has finished
+    results = await asyncio.gather(*(
+        _answer_query(
+            db, manager, run, query_text, request.top_k, request.hops, rag_results, prompt,
+            llm_config=_llm_config(request.cache)
+        )
+        for query_text, rag_results, prompt in zip(request.queries, rag_batch, prompts)
+    ), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    await run_in_threadpool(db.commit)
+    
+    return BatchQueryResponse(run_id=run_id, results=results)
+
+@router.post("/{run_id}/stream")
+async def query_llm_stream(
+    run_id: str,
+    request: QueryRequest,
+    db: Session = Depends(get_db),
+    api_key: Optional[str] = Depends(get_api_key)
+):
+    """Query the LLM with graph context, relaying tokens as server-sent events.
+    
+    Events: "context" (query id and retrieval stats), one "token" per chunk,
+    then "done" with token counts, cost, ttft_ms and tokens_per_sec once the
+    logs are written. A failed generation ends with "error" instead and is
+    not logged.
+    """
+    
+    # Get run
+    run = await run_in_threadpool(_get_run, db, run_id)
+    
+    manager = _get_manager(db, request.retriever)
+    rag_results = await _retrieve(
+        manager.prepare_rag_context,
+        graph_id=run.graph_id,
         query_text=request.query_text,
-        context=rag_results["context"],
-        prompt_template_id="default_rag"
+        top_k=request.top_k,
+        hops=request.hops,
+        max_context_tokens=request.max_context_tokens
     )
+    # Built before the body streams: the request's session may be closed by then
+    prompt = await run_in_threadpool(manager.build_prompt, request.query_text, rag_results["context"])
+    query_id = generate_query_id()
     
-    # Save generation log
-    generation_log = GenerationLog(
-        run_id=run_id,
-        query_id=query_id,
-        llm_name="default",
-        llm_params_json=json.dumps({"temperature": 0.2, "top_p": 0.9}),
-        prompt_tokens=gen_results.get("prompt_tokens", 0),
-        completion_tokens=gen_results.get("completion_tokens", 0),
-        total_tokens=gen_results.get("total_tokens", 0),
-        est_cost_usd=gen_results.get("est_cost_usd", 0.0),
-        llm_answer_text=gen_results.get("answer_text", ""),
-        llm_pred_label=gen_results.get("llm_pred_label"),
-        confidence=gen_results.get("confidence")
+    async def events():
+        yield _sse("context", {
+            "query_id": query_id,
+            "tokens_in_context": rag_results["tokens_in_context"],
+            "retrieval_ms": rag_results["retrieval_ms"]
+        })
+        
+        gen_results = {}
+        async for event in manager.astream_response(prompt, llm_config=_llm_config(request.cache)):
+            if "token" in event:
+                yield _sse("token", {"text": event["token"]})
+            else:
+                gen_results = event["result"]
+        
+        if gen_results.get("error"):
+            yield _sse("error", {
+                "query_id": query_id,
+                "status_code": _generation_error_status(gen_results),
+                "detail": gen_results["error"]
+            })
+            return
+        
+        await run_in_threadpool(
+            _save_stream_logs, run_id, query_id, request.query_text, request.top_k, request.hops,
+            rag_results, gen_results
+        )
+        
+        yield _sse("done", {
+            "query_id": query_id,
+            "llm_answer_text": gen_results.get("answer_text", ""),
+            "prompt_tokens": gen_results.get("prompt_tokens"),
+            "completion_tokens": gen_results.get("completion_tokens"),
+            "total_tokens": gen_results.get("total_tokens"),
+            "est_cost_usd": gen_results.get("est_cost_usd"),
+            "retrieval_ms": rag_results["retrieval_ms"],
+            "generation_ms": gen_results.get("generation_ms"),
+            "ttft_ms": gen_results.get("ttft_ms"),
+            "tokens_per_sec": gen_results.get("tokens_per_sec"),
+            "cache_hit": gen_results.get("cache_hit", False),
+            "saved_cost_usd": gen_results.get("saved_cost_usd"),
+            "saved_ms": gen_results.get("saved_ms")
+        })
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
-    db.add(generation_log)
-    db.commit()
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _llm_config(cache: Optional[bool]) -> Dict[str, Any]:
+    return {} if cache is None else {"cache": cache}
+
+def _generation_error_status(gen_results: Dict[str, Any]) -> int:
+    """429 when the provider was still rate limiting after the retries, else 503"""
+    return 429 if gen_results.get("error_status") == 429 else 503
+
+def _get_run(db: Session, run_id: str) -> Run:
+    run = db.query(Run).filter(Run.run_id == run_id).first()
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run
+
+def _get_manager(db: Session, retriever: Optional[str]) -> AgentManager:
+    try:
+        return AgentManager(db, retriever=retriever)
+    except (RuntimeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _retrieve(prepare: Callable[..., Any], **kwargs) -> Any:
+    """Prepare context in the threadpool; a retriever that cannot load is a 400"""
+    try:
+        return await run_in_threadpool(prepare, **kwargs)
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _answer_query(
+    db: Session,
+    manager: AgentManager,
+    run: Run,
+    query_text: str,
+    top_k: int,
+    hops: int,
+    rag_results: Dict[str, Any],
+    prompt: str,
+    llm_config: Optional[Dict[str, Any]] = None
+) -> QueryResponse:
+    """Generate an answer for a built prompt and stage its logs (caller commits).
+    
+    A failed generation is returned with error and status_code set and is not
+    logged: provider failures are errors, not answers.
+    """
+    run_id = run.run_id
+    
+    # Generate query ID
+    query_id = generate_query_id()
+    
+    # Generate response
+    gen_results = await manager.agenerate_response(prompt, llm_config=llm_config)
+    error = gen_results.get("error")
+    if not error:
+        _log_query(db, run_id, query_id, query_text, top_k, hops, rag_results)
+        _log_generation(db, run_id, query_id, gen_results)
     
     # Calculate total time
     total_ms = rag_results["retrieval_ms"] + gen_results["generation_ms"]
@@ -95,18 +254,18 @@ def query_llm(
         graph_id=run.graph_id,
         task_type=run.task_type.value,
         query_id=query_id,
-        query_text=request.query_text,
+        query_text=query_text,
         retrieved_context=rag_results["context"],
         tokens_in_context=rag_results["tokens_in_context"],
-        k=request.top_k,
-        hops=request.hops,
+        k=top_k,
+        hops=hops,
         prompt_template_id="default_rag",
         llm_name="default",
         llm_params={"temperature": 0.2, "top_p": 0.9},
         prompt_tokens=gen_results.get("prompt_tokens"),
         completion_tokens=gen_results.get("completion_tokens"),
         total_tokens=gen_results.get("total_tokens"),
-        llm_answer_text=gen_results.get("answer_text", ""),
+        llm_answer_text="" if error else gen_results.get("answer_text", ""),
         llm_pred_label=gen_results.get("llm_pred_label"),
         gold=None,
         is_exact_match=None,
@@ -116,8 +275,87 @@ def query_llm(
         rouge=None,
         bertscore=None,
         retrieval_ms=rag_results["retrieval_ms"],
+        retriever_timings=rag_results.get("retriever_timings"),
         generation_ms=gen_results["generation_ms"],
         total_ms=total_ms,
         est_cost_usd=gen_results.get("est_cost_usd"),
-        confidence=gen_results.get("confidence")
-    )
\ No newline at end of file
+        cache_hit=gen_results.get("cache_hit", False),
+        saved_cost_usd=gen_results.get("saved_cost_usd"),
+        saved_ms=gen_results.get("saved_ms"),
+        coalesced=gen_results.get("coalesced", False),
+        confidence=gen_results.get("confidence"),
+        error=error,
+        status_code=_generation_error_status(gen_results) if error else None
+    )
+
+def _log_query(
+    db: Session,
+    run_id: str,
+    query_id: str,
+    query_text: str,
+    top_k: int,
+    hops: int,
+    rag_results: Dict[str, Any]
+):
+    """Stage the query and its retrieval log (caller commits)"""
+    # Save query
+    query = QueryModel(
+        run_id=run_id,
+        query_id=query_id,
+        query_text=query_text
+    )
+    db.add(query)
+    
+    # Save retrieval log
+    retrieval_log = RetrievalLog(
+        run_id=run_id,
+        query_id=query_id,
+        k=top_k,
+        hops=hops,
+        prompt_template_id="default_rag",
+        tokens_in_context=rag_results["tokens_in_context"],
+        context_preview=rag_results["context"][:500]
+    )
+    db.add(retrieval_log)
+
+def _save_stream_logs(
+    run_id: str,
+    query_id: str,
+    query_text: str,
+    top_k: int,
+    hops: int,
+    rag_results: Dict[str, Any],
+    gen_results: Dict[str, Any]
+):
+    """Write the logs of a streamed query on a session of its own: the
+    request's session may already be closed once the body streams"""
+    log_db = SessionLocal()
+    try:
+        _log_query(log_db, run_id, query_id, query_text, top_k, hops, rag_results)
+        _log_generation(log_db, run_id, query_id, gen_results)
+        log_db.commit()
+    finally:
+        log_db.close()
+
+def _log_generation(db: Session, run_id: str, query_id: str, gen_results: Dict[str, Any]):
+    """Stage the generation log (caller commits)"""
+    generation_log = GenerationLog(
+        run_id=run_id,
+        query_id=query_id,
+        llm_name="default",
+        llm_params_json=json.dumps({"temperature": 0.2, "top_p": 0.9}),
+        prompt_tokens=gen_results.get("prompt_tokens", 0),
+        completion_tokens=gen_results.get("completion_tokens", 0),
+        total_tokens=gen_results.get("total_tokens", 0),
+        est_cost_usd=gen_results.get("est_cost_usd", 0.0),
+        llm_answer_text=gen_results.get("answer_text", ""),
+        llm_pred_label=gen_results.get("llm_pred_label"),
+        confidence=gen_results.get("confidence"),
+        ttft_ms=gen_results.get("ttft_ms"),
+        tokens_per_sec=gen_results.get("tokens_per_sec"),
+        cache_hit=gen_results.get("cache_hit", False),
+        coalesced=gen_results.get("coalesced", False),
+        saved_cost_usd=gen_results.get("saved_cost_usd"),
+        saved_ms=gen_results.get("saved_ms")
+    )
+    db.add(generation_log)
\ No newline at end of file
@@ -51,7 +51,12 @@ def get_results_table(
             "tokens_in_context": retrieval.tokens_in_context if retrieval else None,
             "llm_answer": generation.llm_answer_text if generation else None,
             "total_tokens": generation.total_tokens if generation else None,
-            "est_cost_usd": generation.est_cost_usd if generation else None
+            "est_cost_usd": generation.est_cost_usd if generation else None,
+            "ttft_ms": generation.ttft_ms if generation else None,
+            "tokens_per_sec": generation.tokens_per_sec if generation else None,
+            "cache_hit": generation.cache_hit if generation else None,
+            "coalesced": generation.coalesced if generation else None,
+            "saved_cost_usd": generation.saved_cost_usd if generation else None
         }
         results.append(row)
     
@@ -1,13 +1,25 @@
 # schemas/llm.py
 from pydantic import BaseModel
-from typing import Optional, Any
+from typing import Optional, Any, Dict, List
 from schemas.base import BaseSchema
 
 class QueryRequest(BaseModel):
     query_text: str
     top_k: int = 5
     hops: int = 2
+    max_context_tokens: Optional[int] = None
     llm_config_id: Optional[int] = None
+    retriever: Optional[str] = None
+    cache: Optional[bool] = None  # None: reuse cached answers only at temperature 0
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+    hops: int = 2
+    max_context_tokens: Optional[int] = None
+    llm_config_id: Optional[int] = None
+    retriever: Optional[str] = None
+    cache: Optional[bool] = None  # None: reuse cached answers only at temperature 0
 
 class QueryResponse(BaseSchema):
     # Meta
@@ -51,9 +63,22 @@ class QueryResponse(BaseSchema):
     
     # Runtime/cost
     retrieval_ms: float
+    retriever_timings: Optional[Dict[str, Optional[float]]] = None  # None: component skipped
     generation_ms: float
     total_ms: float
     est_cost_usd: Optional[float]
+    cache_hit: bool = False
+    saved_cost_usd: Optional[float] = None
+    saved_ms: Optional[float] = None
+    coalesced: bool = False
     
     # Confidence
-    confidence: Optional[float]
\ No newline at end of file
+    confidence: Optional[float]
+    
+    # Failed generation (batch items only; a single query fails the request)
+    error: Optional[str] = None
+    status_code: Optional[int] = None
+
+class BatchQueryResponse(BaseModel):
+    run_id: str
+    results: List[QueryResponse]
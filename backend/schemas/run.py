@@ -1,6 +1,6 @@
 # schemas/run.py
 from pydantic import BaseModel
-from typing import Optional, Literal
+from typing import Any, Dict, Optional, Literal
 from datetime import datetime
 from schemas.base import BaseSchema
 
@@ -13,4 +13,17 @@ class RunResponse(BaseSchema):
     timestamp: datetime
     graph_id: str
     task_type: str
-    status: str
\ No newline at end of file
+    status: str
+
+class JobResponse(BaseModel):
+    job_id: str
+    kind: str
+    run_id: Optional[str]
+    status: str
+    progress: float
+    message: str
+    result: Optional[Dict[str, Any]]
+    error: Optional[str]
+    created_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
\ No newline at end of file
@@ -0,0 +1,207 @@
+# utils/cache.py
+import asyncio
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+# Invalidation scopes: what kind of graph data changed
+TEXT_SCOPE = "text"
+STRUCTURE_SCOPE = "structure"
+FEATURE_SCOPE = "features"
+ALL_SCOPES = (TEXT_SCOPE, STRUCTURE_SCOPE, FEATURE_SCOPE)
+
+# hook(graph_id, changed_node_ids or None)
+InvalidationHook = Callable[[str, Optional[Set[str]]], None]
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and/or approximate size in bytes"""
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._build_locks: Dict[Hashable, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key][0]
+
+    def put(self, key: Hashable, value: Any):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            value, size = self._data.pop(key)
+            self._bytes -= size
+            return value
+
+    def pop_where(self, predicate: Callable[[Hashable], bool]) -> List[Any]:
+        """Remove every entry whose key matches predicate; returns values oldest first"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            values = []
+            for key in keys:
+                value, size = self._data.pop(key)
+                self._bytes -= size
+                values.append(value)
+            return values
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every entry whose key matches predicate; returns number dropped"""
+        return len(self.pop_where(predicate))
+
+    def get_or_build(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """Return cached value, building it at most once per key under concurrency.
+
+        A build that returns None is not cached.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    return self._data[key][0]
+            try:
+                value = build()
+                if value is not None:
+                    self.put(key, value)
+            finally:
+                with self._lock:
+                    self._build_locks.pop(key, None)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def _evict(self):
+        # Never evict the most recent entry, even if it alone exceeds max_bytes
+        while len(self._data) > 1 and (
+            (self.max_entries is not None and len(self._data) > self.max_entries)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            _, (_, size) = self._data.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+
+class SingleFlight:
+    """Coalesces concurrent identical coroutine calls into one.
+
+    The first caller for a key starts fn() as a task; callers arriving while
+    it runs await the same task. The task is shielded, so a caller that goes
+    away does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Tuple[asyncio.AbstractEventLoop, Hashable], asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """(result, whether it came from another caller's in-flight call)"""
+        loop = asyncio.get_running_loop()
+        task_key = (loop, key)
+        task = self._tasks.get(task_key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+        else:
+            self.calls += 1
+            task = loop.create_task(fn())
+            self._tasks[task_key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(task_key, None))
+        return await asyncio.shield(task), shared
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._tasks),
+            "calls": self.calls,
+            "shared": self.shared
+        }
+
+
+# Process-wide graph versions and invalidation hooks
+_graph_versions: Dict[tuple, int] = defaultdict(int)
+_invalidation_hooks: Dict[str, List[InvalidationHook]] = defaultdict(list)
+_versions_lock = threading.Lock()
+
+
+def graph_version(graph_id: str, scope: Optional[str] = None) -> int:
+    """Monotonic counter bumped every time a graph's data (of the given scope) changes"""
+    with _versions_lock:
+        return _graph_versions[(graph_id, scope)]
+
+
+def register_invalidation_hook(scope: str, hook: InvalidationHook):
+    """Call hook(graph_id, node_ids) whenever data of the given scope changes for a graph.
+
+    node_ids is the set of nodes whose data changed, or None if the whole graph
+    should be treated as changed.
+    """
+    _invalidation_hooks[scope].append(hook)
+
+
+def invalidate_graph(
+    graph_id: str,
+    scopes: Iterable[str] = ALL_SCOPES,
+    node_ids: Optional[Iterable[str]] = None
+):
+    """Mark graph data as changed and drop (or patch) derived caches for the given scopes"""
+    changed = set(node_ids) if node_ids is not None else None
+    with _versions_lock:
+        _graph_versions[(graph_id, None)] += 1
+        for scope in scopes:
+            _graph_versions[(graph_id, scope)] += 1
+    for scope in scopes:
+        for hook in _invalidation_hooks[scope]:
+            hook(graph_id, changed)
+# Process-wide LRU caches and graph invalidation
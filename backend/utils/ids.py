@@ -14,4 +14,13 @@ def generate_query_id() -> str:
 
 def generate_graph_id() -> str:
     unique_id = str(uuid.uuid4())[:12]
-    return f"graph_{unique_id}"# run_id, query_id utilities
+    return f"graph_{unique_id}"
+
+def generate_upload_id() -> str:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    unique_id = str(uuid.uuid4())[:8]
+    return f"upload_{timestamp}_{unique_id}"
+
+def generate_job_id() -> str:
+    unique_id = str(uuid.uuid4())[:12]
+    return f"job_{unique_id}"# run_id, query_id utilities
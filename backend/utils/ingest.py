@@ -0,0 +1,163 @@
+# utils/ingest.py
+import os
+from itertools import repeat
+import pandas as pd
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from typing import Callable, Iterator, List, Optional, Tuple
+from core.config import settings
+
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+ARROW_EXTENSIONS = (".arrow", ".feather", ".ipc", ".arrows")
+
+
+def _column(df: pd.DataFrame, names: List[str], position: Optional[int] = None, default: str = "") -> pd.Series:
+    """First of the named columns present, else the column at position, else a constant"""
+    for name in names:
+        if name in df.columns:
+            return df[name].astype(str)
+    if position is not None and position < len(df.columns):
+        return df.iloc[:, position].astype(str)
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def edge_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """src, dst, relation columns of an edge list (source/target/type also accepted)"""
+    return pd.DataFrame({
+        "src": _column(df, ["src", "source"], 0),
+        "dst": _column(df, ["dst", "target"], 1),
+        "relation": _column(df, ["relation", "type"], default="connects")
+    })
+
+
+def node_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """node_id, label columns of a node list (id/type also accepted)"""
+    return pd.DataFrame({
+        "node_id": _column(df, ["node_id", "id"], 0),
+        "label": _column(df, ["label", "type"], default="node")
+    })
+
+
+def text_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """node_id, text columns of a node text file (id/content also accepted)"""
+    return pd.DataFrame({
+        "node_id": _column(df, ["node_id", "id"], 0),
+        "text": _column(df, ["text", "content"], 1)
+    })
+
+
+def bulk_insert(db: Session, model, graph_id: str, df: pd.DataFrame, chunk_rows: Optional[int] = None) -> int:
+    """Insert every row of df into model's table with executemany, chunk by chunk.
+
+    Rows are staged in the caller's transaction; the caller commits once.
+    """
+    chunk_rows = chunk_rows or settings.INGEST_CHUNK_ROWS
+    table = model.__table__
+    keys = list(df.columns) + ["graph_id"]
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        # Plain column lists zip into records much faster than DataFrame.to_dict
+        columns = [chunk[name].tolist() for name in df.columns]
+        records = [dict(zip(keys, row)) for row in zip(*columns, repeat(graph_id))]
+        db.execute(insert(table), records)
+    return len(df)
+
+
+def detect_format(filename: Optional[str], head: bytes = b"") -> str:
+    """'parquet', 'arrow' or 'csv', from the file's magic bytes or extension"""
+    if head[:4] == b"PAR1":
+        return "parquet"
+    if head[:6] == b"ARROW1" or head[:4] == b"\xff\xff\xff\xff":
+        return "arrow"
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext in PARQUET_EXTENSIONS:
+        return "parquet"
+    if ext in ARROW_EXTENSIONS:
+        return "arrow"
+    return "csv"
+
+
+def _csv_batches(filepath: str) -> Iterator[Tuple[pd.DataFrame, int, int]]:
+    total = os.path.getsize(filepath)
+    with open(filepath, 'rb') as f:
+        try:
+            for raw in pd.read_csv(f, chunksize=settings.INGEST_CHUNK_ROWS):
+                yield raw, f.tell(), total
+        except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+            raise RuntimeError(f"Invalid CSV file: {e}") from e
+
+
+def _arrow_batches(filepath: str, file_format: str) -> Iterator[Tuple[pd.DataFrame, int, int]]:
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError(
+            "Parquet/Arrow uploads need pyarrow (pip install pyarrow)"
+        ) from e
+
+    # Corrupt or truncated files raise ArrowInvalid / ArrowIOError, from
+    # opening the file or from any later batch
+    try:
+        if file_format == "parquet":
+            reader = pyarrow.parquet.ParquetFile(filepath)
+            total = reader.metadata.num_rows
+            batches = reader.iter_batches(batch_size=settings.INGEST_CHUNK_ROWS)
+        else:
+            # Memory-mapped, so record batches reference the file without copying
+            source = pa.memory_map(filepath)
+            try:
+                reader = pyarrow.ipc.open_file(source)
+                total = sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+                batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            except pa.ArrowInvalid:
+                source.seek(0)
+                reader = pyarrow.ipc.open_stream(source)
+                total = 0
+                batches = iter(reader)
+
+        done = 0
+        for batch in batches:
+            # Re-slice large IPC batches so each insert stays within INGEST_CHUNK_ROWS
+            for offset in range(0, batch.num_rows, settings.INGEST_CHUNK_ROWS):
+                part = batch.slice(offset, settings.INGEST_CHUNK_ROWS)
+                done += part.num_rows
+                yield part.to_pandas(), done, max(total, done)
+    except pa.ArrowException as e:
+        raise RuntimeError(f"Invalid {file_format} file: {e}") from e
+
+
+def ingest_file(
+    db: Session,
+    model,
+    graph_id: str,
+    filepath: str,
+    columns: Callable[[pd.DataFrame], pd.DataFrame],
+    file_format: str = "csv",
+    progress: Optional[Callable[[int, int, int], None]] = None,
+    on_chunk: Optional[Callable[[pd.DataFrame], None]] = None
+) -> int:
+    """Stream a CSV, Parquet or Arrow IPC file into model's table in chunks.
+
+    Only one chunk (INGEST_CHUNK_ROWS rows) is in memory at once, whatever the
+    file size. Columnar files are read column-wise batch by batch. columns maps
+    a raw chunk to the table's columns; progress(rows, done, total) is called
+    after every chunk (done/total are bytes for CSV, rows for Parquet/Arrow)
+    and on_chunk sees each mapped chunk. Unreadable files raise RuntimeError.
+    """
+    if file_format == "csv":
+        batches = _csv_batches(filepath)
+    else:
+        batches = _arrow_batches(filepath, file_format)
+
+    rows = 0
+    for raw, done, total in batches:
+        chunk = columns(raw)
+        rows += bulk_insert(db, model, graph_id, chunk)
+        if on_chunk:
+            on_chunk(chunk)
+        if progress:
+            progress(rows, done, total)
+    return rows
+# Bulk graph ingestion helpers
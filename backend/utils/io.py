@@ -1,9 +1,19 @@
 # utils/io.py
 import os
 import json
+import shutil
+import time
+import uuid
 import pandas as pd
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
+
+# Versioned artifact directories: each build goes to its own v_* directory and
+# the CURRENT file (replaced atomically) names the live one
+CURRENT_NAME = "CURRENT"
+# Superseded versions are deleted only once this old, so a reader that has just
+# resolved CURRENT can still open them
+VERSION_GRACE_S = 60.0
 
 def ensure_dir(path: str):
     Path(path).mkdir(parents=True, exist_ok=True)
@@ -29,4 +39,86 @@ def load_csv(filepath: str) -> pd.DataFrame:
 def save_upload(content: bytes, filepath: str):
     ensure_dir(os.path.dirname(filepath))
     with open(filepath, 'wb') as f:
-        f.write(content)# File save/load utilities; uploads/
+        f.write(content)
+
+async def save_upload_stream(upload, filepath: str, chunk_size: int = 1024 * 1024) -> int:
+    """Copy an UploadFile to disk chunk by chunk; returns bytes written"""
+    ensure_dir(os.path.dirname(filepath))
+    written = 0
+    with open(filepath, 'wb') as f:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            f.write(chunk)
+            written += len(chunk)
+    return written
+
+def new_version_dir(path: str) -> str:
+    """Private build directory under path; invisible to readers until published"""
+    build_dir = os.path.join(path, f".tmp_{uuid.uuid4().hex}")
+    ensure_dir(build_dir)
+    return build_dir
+
+def publish_version(path: str, build_dir: str):
+    """Make a finished build the current version of path.
+
+    The build is renamed to a fresh v_* name (never collides) and CURRENT is
+    replaced atomically, so concurrent publishers simply take turns being
+    current and readers always see one complete version.
+    """
+    name = f"v_{uuid.uuid4().hex}"
+    os.replace(build_dir, os.path.join(path, name))
+    tmp_pointer = os.path.join(path, f".{name}.current")
+    with open(tmp_pointer, 'w') as f:
+        f.write(name)
+    os.replace(tmp_pointer, os.path.join(path, CURRENT_NAME))
+    prune_versions(path)
+
+def current_version(path: str) -> Optional[str]:
+    """Directory of the current version of path, or None if nothing is published"""
+    try:
+        with open(os.path.join(path, CURRENT_NAME)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(path, name) if name else None
+
+def version_stamp(path: str) -> Optional[Tuple[int, int]]:
+    """Changes whenever a version is published or unpublished (cheap: one stat)"""
+    try:
+        stat = os.stat(os.path.join(path, CURRENT_NAME))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+def unpublish(path: str):
+    """Drop the current version; its files go with the next prune"""
+    try:
+        os.remove(os.path.join(path, CURRENT_NAME))
+    except FileNotFoundError:
+        pass
+    prune_versions(path)
+
+def prune_versions(path: str):
+    """Delete superseded versions older than VERSION_GRACE_S"""
+    current = current_version(path)
+    now = time.time()
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        # Dot-entries are builds and pointers still being published
+        if entry.name == CURRENT_NAME or entry.name.startswith(".") or entry.path == current:
+            continue
+        try:
+            if now - entry.stat().st_mtime < VERSION_GRACE_S:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+# File save/load utilities; uploads/
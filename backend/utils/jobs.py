@@ -0,0 +1,153 @@
+# utils/jobs.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from core.config import settings
+from models.enums import JobStatus
+from utils.ids import generate_job_id
+
+logger = logging.getLogger(__name__)
+
+# progress(fraction in [0, 1], message); raises JobCancelled once cancellation is requested
+ProgressCallback = Callable[[float, str], None]
+
+FINISHED = (JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised from a progress checkpoint of a job whose cancellation was requested"""
+
+
+class Job:
+    """One background pipeline stage: status, progress and result"""
+
+    def __init__(self, kind: str, run_id: Optional[str] = None):
+        self.job_id = generate_job_id()
+        self.kind = kind
+        self.run_id = run_id
+        self.status = JobStatus.QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.future: Optional[Future] = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def report(self, fraction: float, message: str = ""):
+        """Progress checkpoint; stages call this between units of work"""
+        if self._cancel.is_set():
+            raise JobCancelled(self.job_id)
+        self.progress = min(max(float(fraction), 0.0), 1.0)
+        self.message = message
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "run_id": self.run_id,
+            "status": self.status.value,
+            "progress": round(self.progress, 4),
+            "message": self.message,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobManager:
+    """In-process job queue on a thread pool.
+
+    Work runs on JOB_WORKERS threads, so a long stage no longer holds a
+    request worker. Cancellation is cooperative: queued jobs never start and
+    running jobs stop at their next progress checkpoint. Only the latest
+    JOB_HISTORY finished jobs are kept.
+    """
+
+    def __init__(self, max_workers: int, history: int):
+        self.history = history
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        kind: str,
+        fn: Callable[[ProgressCallback], Dict[str, Any]],
+        run_id: Optional[str] = None
+    ) -> Job:
+        """Queue fn(progress) and return its job; fn's return value becomes the result"""
+        job = Job(kind, run_id)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune()
+        job.future = self._pool.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job: Job, fn: Callable[[ProgressCallback], Dict[str, Any]]):
+        if job.cancel_requested:
+            self._finish(job, JobStatus.CANCELLED)
+            return
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = fn(job.report)
+        except JobCancelled:
+            self._finish(job, JobStatus.CANCELLED)
+        except Exception as e:
+            logger.exception(f"Job {job.job_id} ({job.kind}) failed")
+            job.error = f"{type(e).__name__}: {e}"
+            self._finish(job, JobStatus.FAILED)
+        else:
+            job.progress = 1.0
+            job.message = "done"
+            self._finish(job, JobStatus.DONE)
+
+    def _finish(self, job: Job, status: JobStatus):
+        job.status = status
+        job.finished_at = time.time()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, run_id: Optional[str] = None) -> List[Job]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in jobs if run_id is None or job.run_id == run_id]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Request cancellation; returns the job, or None if it is unknown"""
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        job._cancel.set()
+        if job.future is not None and job.future.cancel():
+            self._finish(job, JobStatus.CANCELLED)
+        return job
+
+    def shutdown(self):
+        """Cancel everything still queued or running and stop the workers"""
+        for job in self.list():
+            self.cancel(job.job_id)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+job_manager = JobManager(max_workers=settings.JOB_WORKERS, history=settings.JOB_HISTORY)
+# Background job queue for pipeline stages
\ No newline at end of file
@@ -1,4 +1,64 @@
 # utils/tokens.py
+import functools
+import logging
+import threading
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """tiktoken encoding named by TOKENIZER_ENCODING, or None if it cannot be loaded
+    (e.g. the BPE file cannot be downloaded)"""
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(settings.TOKENIZER_ENCODING)
+            except Exception as e:
+                logger.warning(f"tiktoken unavailable ({e}); counting tokens as ~4 chars each")
+                _encoding = None
+            _encoding_loaded = True
+        return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count from the real tokenizer when available"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        # Round up so packing against a budget never overflows
+        return -(-len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+@functools.lru_cache(maxsize=settings.TOKEN_COUNT_CACHE_SIZE)
+def count_node_tokens(text: str) -> int:
+    """count_tokens memoized per text, for node texts and context lines.
+
+    Whole assembled contexts go through count_tokens: they rarely repeat and
+    would pin up to TOKEN_COUNT_CACHE_SIZE large strings in memory.
+    """
+    return count_tokens(text)
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of a node text that fits in max_tokens"""
+    if max_tokens <= 0:
+        return ""
+    if count_node_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
 def estimate_tokens(text: str) -> int:
     """Rough token estimation: ~4 chars per token"""
     if not text: